@@ -0,0 +1,175 @@
+# -*- coding: utf-8 -*-
+"""cis519_hw3_benchmark.py
+
+Benchmark of the HW3 logistic regression trainers
+
+Runs every solver of LogisticRegression and LogisticRegressionAdagrad on the bundled
+hw3-wdbc.csv, hw3-diabetes.csv and hw3-retinopathy.csv and on synthetic n-by-d problems,
+and writes one JSON record per run (fit time, iterations, peak memory, predict throughput)
+so results of different versions can be compared line by line.
+
+Usage:
+    python cis519_hw3_benchmark.py --output results.jsonl
+    python cis519_hw3_benchmark.py --quick          # small synthetic sweep only, for a smoke test
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from cis519_hw3_solution import LogisticRegression, LogisticRegressionAdagrad
+
+"""# Configurations"""
+
+DATA_DIR = os.path.dirname(os.path.abspath(__file__))
+DATASETS = ['hw3-wdbc.csv', 'hw3-diabetes.csv', 'hw3-retinopathy.csv']
+SYNTHETIC_SIZES = [(1000, 10), (10000, 10), (10000, 100), (100000, 10), (100000, 100)]
+QUICK_SIZES = [(1000, 10), (5000, 20)]
+
+# (name, model class, constructor arguments, largest n it is run on), every model standardizes its own features
+# gd keeps the fixed alpha of the homework, its step grows with n (the gradient is a sum), so on the large
+# synthetic problems it stops converging, which shows up in n_iter and train_accuracy
+SOLVERS = [
+    ('gd_L2', LogisticRegression, dict(solver='gd', regNorm=2, regLambda=0.01, alpha=0.001, maxNumIters=10000), None),
+    ('newton_L2', LogisticRegression, dict(solver='newton', regNorm=2, regLambda=0.01), None),
+    ('lbfgs_L2', LogisticRegression, dict(solver='lbfgs', regNorm=2, regLambda=0.01), None),
+    ('lbfgs_L1', LogisticRegression, dict(solver='lbfgs', regNorm=1, regLambda=0.01), None),
+    ('fista_L1', LogisticRegression, dict(solver='fista', regNorm=1, regLambda=0.01), None),
+    ('adagrad_L2_b1', LogisticRegressionAdagrad, dict(regNorm=2, regLambda=0.01, batchSize=1, maxNumIters=20, randomState=0), 20000),
+    ('adagrad_L2_b64', LogisticRegressionAdagrad, dict(regNorm=2, regLambda=0.01, batchSize=64, maxNumIters=100, randomState=0), None),
+]
+
+"""# Data"""
+
+def loadDataset(filename):
+    '''
+    Loads one of the bundled headerless CSVs, the label is binarized against the label
+    of the first row (same as test_dataanalysis)
+    Returns:
+        X an n-by-d Pandas data frame, y an n-by-1 numpy array of 0/1 labels
+    '''
+    df = pd.read_csv(os.path.join(DATA_DIR, filename), header=None)
+    X = df[df.columns[0:-1]]
+    y_slice = df.iloc[:, -1]
+    y = (y_slice == y_slice.iloc[0]).to_numpy().astype(np.int64)
+    return X, y
+
+
+def makeSynthetic(n, d, seed = 0):
+    '''
+    Random logistic regression problem with n instances and d features, the labels are drawn
+    from the sigmoid of a random linear score so the classes overlap (no separable data)
+    '''
+    rng = np.random.default_rng(seed)
+    X = rng.standard_normal((n, d)) * rng.uniform(0.5, 5, d) + rng.uniform(-3, 3, d)
+    theta = rng.standard_normal(d) / np.sqrt(d)
+    z = np.dot((X - X.mean(0)) / X.std(0), theta)
+    y = (rng.random(n) < 1 / (1 + np.exp(-z))).astype(np.int64)
+    return pd.DataFrame(X), y
+
+"""# Measurements"""
+
+def benchmarkModel(modelClass, params, X, y, repeats = 3, predictRepeats = 5):
+    '''
+    Fits modelClass(**params) on X, y
+    Returns:
+        a dict with the best fit time out of repeats, the iterations of the last fit, the peak traced
+        memory of one fit (measured in a separate, untimed fit because tracing slows allocations down),
+        the predict throughput in rows per second and the training accuracy
+    '''
+    fitTimes = []
+    for r in range(repeats):
+        np.random.seed(r)   # LogisticRegression draws its initial theta from np.random
+        model = modelClass(**params)
+        start = time.perf_counter()
+        model.fit(X, y)
+        fitTimes.append(time.perf_counter() - start)
+
+    np.random.seed(0)
+    tracemalloc.start()
+    modelClass(**params).fit(X, y)
+    peakBytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    predictTimes = []
+    for r in range(predictRepeats):
+        start = time.perf_counter()
+        y_predict = model.predict(X)
+        predictTimes.append(time.perf_counter() - start)
+
+    return {
+        'fit_seconds': min(fitTimes),
+        'n_iter': None if model.n_iter_ is None else int(model.n_iter_),
+        'peak_memory_mb': peakBytes / 2**20,
+        'predict_rows_per_second': len(y) / max(min(predictTimes), 1E-9),
+        'train_accuracy': float(np.mean(y_predict.to_numpy() == y)),
+    }
+
+
+def environment():
+    '''
+    Versions recorded with every result, so runs on different commits / machines can be told apart
+    '''
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=DATA_DIR, capture_output=True,
+                                text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'pandas': pd.__version__,
+        'machine': platform.machine(),
+    }
+
+"""# Benchmark"""
+
+def runBenchmark(output, quick = False, repeats = 3, solvers = None):
+    '''
+    Runs every solver (or the names listed in solvers) on the bundled datasets and the synthetic sweep
+    and appends one JSON line per (problem, solver) to output (a file object), the lines are also printed
+    '''
+    env = environment()
+    problems = []
+    if not quick:
+        for filename in DATASETS:
+            problems.append((filename, lambda filename=filename: loadDataset(filename)))
+    for n, d in (QUICK_SIZES if quick else SYNTHETIC_SIZES):
+        problems.append(('synthetic_%dx%d' % (n, d), lambda n=n, d=d: makeSynthetic(n, d)))
+
+    for problem, load in problems:
+        X, y = load()
+        for name, modelClass, params, maxN in SOLVERS:
+            if solvers is not None and name not in solvers:
+                continue
+            if maxN is not None and X.shape[0] > maxN:   # one python step per row, too slow for the large sweeps
+                continue
+            record = {'problem': problem, 'n': int(X.shape[0]), 'd': int(X.shape[1]), 'solver': name}
+            record.update(benchmarkModel(modelClass, dict(params, standardize=True), X, y, repeats))
+            record.update(env)
+            line = json.dumps(record)
+            print(line)
+            output.write(line + '\n')
+            output.flush()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark of the HW3 logistic regression trainers')
+    parser.add_argument('--output', default=None, help='JSON lines file the results are appended to')
+    parser.add_argument('--quick', action='store_true', help='small synthetic problems only')
+    parser.add_argument('--repeats', type=int, default=3, help='fits per problem, the best time is kept')
+    parser.add_argument('--solvers', nargs='*', default=None, help='subset of ' + ', '.join(name for name, _, _, _ in SOLVERS))
+    args = parser.parse_args()
+    if args.output is None:
+        runBenchmark(open(os.devnull, 'w'), args.quick, args.repeats, args.solvers)
+    else:
+        with open(args.output, 'a') as output:
+            runBenchmark(output, args.quick, args.repeats, args.solvers)
@@ -226,13 +226,9 @@ def test_logreg1():
     y_min = X[X.columns[1]].min() - .5
     y_max = X[X.columns[1]].max() + .5
     xx, yy = np.meshgrid(np.arange(x_min, x_max, h), np.arange(y_min, y_max, h))
-    allPoints = pd.DataFrame(np.c_[xx.ravel(), yy.ravel()])
-    allPoints = pd.DataFrame(standardizer.transform(allPoints))
-    Z = logregModel.predict(allPoints)
-    Z = np.asmatrix(Z.to_numpy())
+    Z = predictGrid(logregModel, xx, yy, standardizer)
 
     # Put the result into a color plot
-    Z = Z.reshape(xx.shape)
     plt.figure(1, figsize=(8, 6))
     plt.contourf(xx, yy, Z, cmap=plt.cm.Paired)
 
@@ -269,17 +265,46 @@ def mapFeature(X, column1, column2, maxPower = 6):
         an n-by-d2 Pandas data frame, where each row represents the original features augmented with the new features of the corresponding instance
         the first bias row is not added here
     '''
-    X_1 = X[column1]   # the first column of the X, X1
-    X_2 = X[column2]   # the second column of X, X2
-    X_map = pd.concat([X_1,X_2], axis=1)    # define the new X
-    for d in range(1, maxPower):
-      for i in range(d+2): # 0, 1, 2, ..., d+1
-        x_2_new = X_2.pow(i)    # axis 
-        x_1_new = X_1.pow(d+1-i)
-        new_col = x_1_new.multiply(x_2_new)
-        X_map = pd.concat([X_map, new_col], axis=1)
-    print(X_map)
-    return X_map
+    X_1 = X[column1].to_numpy(dtype=np.float64)   # the first column of the X, X1
+    X_2 = X[column2].to_numpy(dtype=np.float64)   # the second column of X, X2
+    n = len(X_1)
+    # exponents of X1 and X2 for every column, in the order X1, X2, then X1**(d+1-i) * X2**i for d = 1..maxPower-1, i = 0..d+1
+    power_1 = [1, 0] + [d+1-i for d in range(1, maxPower) for i in range(d+2)]
+    power_2 = [0, 1] + [i for d in range(1, maxPower) for i in range(d+2)]
+    # power tables X1**0 .. X1**maxPower and X2**0 .. X2**maxPower, computed once
+    table_1 = np.ones((n, maxPower+1))
+    table_2 = np.ones((n, maxPower+1))
+    for p in range(1, maxPower+1):
+        np.multiply(table_1[:, p-1], X_1, out=table_1[:, p])
+        np.multiply(table_2[:, p-1], X_2, out=table_2[:, p])
+    X_map = np.empty((n, len(power_1)))    # preallocated n-by-d2 output
+    for c in range(len(power_1)):   # one column at a time, no n-by-d2 gathered copies of the tables
+        np.multiply(table_1[:, power_1[c]], table_2[:, power_2[c]], out=X_map[:, c])
+    return pd.DataFrame(X_map, index=X.index, columns=range(len(power_1)), copy=False)    # unique labels 0..d2-1, whatever the input names, X_map is not copied
+
+"""# Decision Boundary Grid"""
+
+def predictGrid(model, xx, yy, standardizer = None, polyPower = None, chunkSize = 10000):
+    '''
+    Predicts the class of every point of the mesh (xx, yy) for plotting the decision boundary
+    The mesh is walked in chunks of chunkSize points, each chunk is mapped (mapFeature with polyPower
+    if given), standardized (standardizer.transform if given), scored with model.predict_proba and
+    thresholded with a vectorized comparison straight into Z, so memory is bounded by one chunk
+    Returns:
+        Z, an array of 0/1 predictions with the shape of xx
+    '''
+    Z = np.empty(xx.shape, dtype=np.int32)
+    Z_flat = Z.reshape(-1)      # view, writing into it fills Z
+    xx_flat = xx.ravel()
+    yy_flat = yy.ravel()
+    for start in range(0, len(Z_flat), chunkSize):
+        points = pd.DataFrame(np.c_[xx_flat[start:start + chunkSize], yy_flat[start:start + chunkSize]])
+        if polyPower is not None:
+            points = mapFeature(points, points.columns[0], points.columns[1], polyPower)
+        if standardizer is not None:
+            points = pd.DataFrame(standardizer.transform(points.to_numpy()))
+        Z_flat[start:start + chunkSize] = model.predict_proba(points).to_numpy()[:, 0] >= 0.5
+    return Z
 
 """# Test Logistic Regression 2"""
 
@@ -321,16 +346,9 @@ def test_logreg2():
     y_max = X[X.columns[1]].max() + .5
     xx, yy = np.meshgrid(np.arange(x_min, x_max, h), np.arange(y_min, y_max, h))
 
-    allPoints = pd.DataFrame(np.c_[xx.ravel(), yy.ravel()])
-    allPoints = mapFeature(allPoints, allPoints.columns[0], allPoints.columns[1], polyPower)
-    allPoints = pd.DataFrame(standardizer.transform(allPoints))
-    Xaug = pd.DataFrame(standardizer.fit_transform(Xaug))  # standardize data
-    
-    Z = logregModel.predict(allPoints)
-    Z = np.asmatrix(Z.to_numpy())
+    Z = predictGrid(logregModel, xx, yy, standardizer, polyPower)
 
     # Put the result into a color plot
-    Z = Z.reshape(xx.shape)
     plt.figure(1, figsize=(8, 6))
     plt.contourf(xx, yy, Z, cmap=plt.cm.Paired)
 
@@ -357,7 +375,7 @@ test_logreg2()
 
 class LogisticRegressionAdagrad:
 
-    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None):     # e = 1e-4
+    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None, callback = None):     # e = 1e-4
         '''
         Constructor
         Arguments:
@@ -367,6 +385,7 @@ class LogisticRegressionAdagrad:
         	epsilon is the convergence parameter
         	maxNumIters is the maximum number of iterations to run
           initTheta is the initial theta value. This is an optional argument
+          callback is an optional function callback(num_iters, theta) called after every outer iteration
         '''
         self.alpha = alpha
         self.regLambda = regLambda
@@ -374,6 +393,7 @@ class LogisticRegressionAdagrad:
         self.epsilon = epsilon
         self.maxNumIters = maxNumIters
         self.theta = initTheta  # give the initial theta to the theta
+        self.callback = callback
         self.X_train_mean = None  # mean value of standardization
         self.X_train_std = None   # standard deviation
     
@@ -486,6 +506,9 @@ class LogisticRegressionAdagrad:
             # print('==============\nCurrent Iter is:' + str(iter + 1))  # print the iter number
             # print('Cost: '+str(self.computeCost(theta, X_shuffled, y_shuffled, self.regLambda)))
 
+            if self.callback is not None:
+                self.callback(iter + 1, theta)    # theta after iter + 1 outer iterations
+
             if iter > 0 and self.hasConverged(theta, theta_old) is True:
                 print('Adagrad converged Iteration:'+str(iter))
                 break
@@ -609,10 +632,9 @@ def test_dataanalysis():
     # tuneRegLambda(Xstandardized, y, )   # tuning lambda
 
     iterValues = [1, 2, 3, 4, 5, 7, 9, 12, 16, 20,30,40,50,100,300, 500, 750, 1000, 2000]   # set the learning curve's variable
-    iter_accuracy = []
-    for i in iterValues:
-        print('========= Max Iter: '+ str(i))
-        iter_accuracy.append(tuneRegLambda(Xstandardized, y, i))
+    iter_accuracy = learningCurve(Xstandardized, y, iterValues)     # one training run per fold for the whole curve
+    for i, curr_accuracy in zip(iterValues, iter_accuracy):
+        print('========= Max Iter: '+ str(i) + '   Accuracy: ' + str(curr_accuracy))
     print(iter_accuracy)
 
 
@@ -622,11 +644,17 @@ test_dataanalysis()
 
 import sklearn as sk
 
-def tuneRegLambda(X, y, iter_times):   # regLambdaValues is value list
+def tuneRegLambda(X, y, iter_times, path=False, n_jobs=1):   # regLambdaValues is value list
     '''
     This function calls the crossvalidation and tries the series of lambda
     num_trials and folds are pre-defined
+    path=True computes the whole accuracy-vs-lambda curve with crossValidationPath (warm-started
+    from large to small lambda on every fold) instead of one cold crossValidation per lambda
+    n_jobs other than 1 runs the folds of every lambda in parallel with crossValidationParallel
+    (cold runs only, the path mode runs serially and raises a ValueError for n_jobs other than 1)
     '''
+    if path and n_jobs != 1:
+        raise ValueError("path=True runs the folds serially, n_jobs must be 1, got " + str(n_jobs))
     # regLambdaValues = np.array([1E-8, 0.001, 0.003, 0.006, 0.01, 0.03, 0.06, 0.1, 0.3, 0.6, 1, 3, 10])    # for tuning 
     regLambdaValues = np.array([0.0001])      # for learning curve
     best_Lambda = 0 
@@ -635,14 +663,25 @@ def tuneRegLambda(X, y, iter_times):   # regLambdaValues is value list
     maxNumIters = iter_times    # for learning curve
 
     accuracy = []
-    for test_lambda in regLambdaValues:
-        # change the model for test
-        logreg_obj = LogisticRegressionAdagrad(alpha=0.01, regLambda = test_lambda, regNorm=2, epsilon=0.001, maxNumIters=iter_times)  # state a new class project 1e-8  / change the maxNunIter
-        curr_accuracy = crossValidation(logreg_obj, X, y, num_trials, num_folds, test_lambda) 
-        accuracy.append(curr_accuracy)    #store the accuracy 
-        print("Current Lambda:"+str(test_lambda))
-        print('Accuracy:'+str(curr_accuracy))
+    if path:
+        logreg_obj = LogisticRegressionAdagrad(alpha=0.01, regNorm=2, epsilon=0.001, maxNumIters=iter_times)
+        accuracy = crossValidationPath(logreg_obj, X, y, num_trials, num_folds, regLambdaValues)
+        for test_lambda, curr_accuracy in zip(regLambdaValues, accuracy):
+            print("Current Lambda:"+str(test_lambda))
+            print('Accuracy:'+str(curr_accuracy))
         print('============================== ')
+    else:
+        for test_lambda in regLambdaValues:
+            # change the model for test
+            logreg_obj = LogisticRegressionAdagrad(alpha=0.01, regLambda = test_lambda, regNorm=2, epsilon=0.001, maxNumIters=iter_times)  # state a new class project 1e-8  / change the maxNunIter
+            if n_jobs == 1:
+                curr_accuracy = crossValidation(logreg_obj, X, y, num_trials, num_folds, test_lambda) 
+            else:
+                curr_accuracy = crossValidationParallel(logreg_obj, X, y, num_trials, num_folds, test_lambda, n_jobs)
+            accuracy.append(curr_accuracy)    #store the accuracy 
+            print("Current Lambda:"+str(test_lambda))
+            print('Accuracy:'+str(curr_accuracy))
+            print('============================== ')
     accuracy = np.array(accuracy)
     best_cvScore = np.max(accuracy) 
     k = np.argwhere(accuracy == best_cvScore)  
@@ -680,4 +719,132 @@ def crossValidation(logreg_obj, X, y, num_trials, num_folds, regLambda):
             total_error = total_error + np.linalg.norm((label_pedict-label_test), ord=1)/n    # error rate
     cvScore = 1 - total_error/(num_trials*num_folds)
     # print('cv Score: '+str(cvScore))
-    return cvScore
\ No newline at end of file
+    return cvScore
+
+"""Parallel Cross Validation"""
+
+import copy
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+
+def crossValidationFold(logreg_obj, shm_name, shape, train_index, test_index, seed):
+    '''
+    Worker of crossValidationParallel: trains a private clone of the model on one fold
+    The standardized [X | y] array is read from the shared memory block shm_name (never pickled)
+
+    Return: the error rate of the fold
+    '''
+    np.random.seed(seed)      # the models shuffle / initialize theta with np.random
+    shm = shared_memory.SharedMemory(name=shm_name)
+    try:
+        data = np.ndarray(shape, dtype=np.float64, buffer=shm.buf)
+        X_train, X_test = pd.DataFrame(data[train_index, 0:-1]), pd.DataFrame(data[test_index, 0:-1])
+        y_train, y_test = pd.DataFrame(data[train_index, -1]), data[test_index, -1]
+    finally:
+        shm.close()
+    logreg_obj.theta = None                       # every fold starts from a fresh theta
+    logreg_obj.fit(X_train, y_train)
+    y_predict = logreg_obj.predict(X_test)
+
+    n = len(test_index)
+    label_test = y_test.reshape(n,1)
+    label_pedict = y_predict.to_numpy().reshape(n,1)
+    return np.linalg.norm((label_pedict-label_test), ord=1)/n    # error rate
+
+def crossValidationParallel(logreg_obj, X, y, num_trials, num_folds, regLambda, n_jobs=None, random_state=0):
+    '''
+    Same score as crossValidation, but the num_trials*num_folds fits run in a process pool
+    Every task gets a deep copy of logreg_obj (so folds never share a theta) and a deterministic
+    seed spawned from random_state, X and y are put once in shared memory instead of being
+    pickled for every task. n_jobs is the number of worker processes (None uses every core)
+
+    Return: a float value of accuracy score
+    '''
+    data = np.c_[np.asarray(X, dtype=np.float64), np.asarray(y, dtype=np.float64).reshape(len(X), 1)]
+    shm = shared_memory.SharedMemory(create=True, size=data.nbytes)
+    try:
+        np.ndarray(data.shape, dtype=np.float64, buffer=shm.buf)[:] = data
+        seeds = np.random.SeedSequence(random_state).generate_state(num_trials*num_folds + num_trials)
+        # fork keeps the functions defined in the notebook visible to the workers
+        context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+        with ProcessPoolExecutor(max_workers=n_jobs, mp_context=context) as executor:
+            futures = []
+            for trial in range(num_trials):
+                kf = KFold(n_splits=num_folds,shuffle=True,random_state=int(seeds[trial]))  # kFold object
+                for train_index, test_index in kf.split(data):
+                    task_seed = int(seeds[num_trials + len(futures)])
+                    futures.append(executor.submit(crossValidationFold, copy.deepcopy(logreg_obj), shm.name,
+                                                   data.shape, train_index, test_index, task_seed))
+            total_error = sum(future.result() for future in futures)
+    finally:
+        shm.close()
+        shm.unlink()
+    cvScore = 1 - total_error/(num_trials*num_folds)
+    return cvScore
+
+def crossValidationPath(logreg_obj, X, y, num_trials, num_folds, regLambdaValues):
+    '''
+    Regularization path version of crossValidation
+    On every fold the lambdas are fitted from large to small, each fit warm-started from the
+    theta of the previous lambda (only the first, largest lambda starts from a fresh theta)
+
+    Return: a numpy array with the accuracy score of every lambda, in the order of regLambdaValues
+    '''
+    regLambdaValues = np.asarray(regLambdaValues)
+    order = np.argsort(regLambdaValues)[::-1]     # large to small lambda
+    total_error = np.zeros(len(regLambdaValues))   # accumulating error of every lambda
+    for trial in range(num_trials):
+        kf = KFold(n_splits=num_folds,shuffle=True,random_state=None)  # kFold object
+        for train_index, test_index in kf.split(X):
+            X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+            y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+            n, d = X_test.shape
+            label_test = y_test.to_numpy().reshape(n,1)
+            logreg_obj.theta = None                       # clear the theta of the last fold, kept between lambdas
+            for k in order:
+                logreg_obj.regLambda = regLambdaValues[k]
+                logreg_obj.fit(X_train, y_train)
+                label_pedict = logreg_obj.predict(X_test).to_numpy().reshape(n,1)
+                total_error[k] = total_error[k] + np.linalg.norm((label_pedict-label_test), ord=1)/n    # error rate
+    cvScores = 1 - total_error/(num_trials*num_folds)
+    return cvScores
+
+"""Learning Curve"""
+
+def learningCurve(X, y, iterValues, regLambda=0.0001, num_trials=3, num_folds=4):
+    '''
+    Cross validated accuracy after each number of iterations in iterValues (the learning curve)
+    Every fold is trained once with maxNumIters = max(iterValues), the callback scores the held-out
+    fold at each checkpoint, so the curve costs the same as the longest run instead of the sum of
+    one run per value. A run that converges early scores its final (converged) theta at the later checkpoints
+
+    Return: a list with the accuracy score of every value of iterValues
+    '''
+    checkpoints = sorted(set(iterValues))
+    total_error = dict((i, 0) for i in checkpoints)   # accumulating error of every checkpoint
+    for trial in range(num_trials):
+        kf = KFold(n_splits=num_folds,shuffle=True,random_state=None)  # kFold object
+        for train_index, test_index in kf.split(X):
+            X_train, X_test = X.iloc[train_index], X.iloc[test_index]
+            y_train, y_test = y.iloc[train_index], y.iloc[test_index]
+            n, d = X_test.shape
+            label_test = y_test.to_numpy().reshape(n,1)
+            X_test_fit = np.c_[np.ones((n, 1)), X_test.to_numpy()]    # add the first column
+            fold_error = {}
+
+            def testError(theta):
+                label_pedict = (np.dot(X_test_fit, theta) >= 0).astype(int)    # sigmoid >= 0.5
+                return np.linalg.norm((label_pedict-label_test), ord=1)/n    # error rate
+
+            def snapshot(num_iters, theta):
+                if num_iters in total_error:
+                    fold_error[num_iters] = testError(theta)
+
+            logreg_obj = LogisticRegressionAdagrad(alpha=0.01, regLambda = regLambda, regNorm=2, epsilon=0.001,
+                                                   maxNumIters=checkpoints[-1], callback=snapshot)
+            logreg_obj.fit(X_train, y_train)
+            final_error = testError(logreg_obj.theta)    # the converged model, not the last checkpoint it passed
+            for i in checkpoints:
+                total_error[i] = total_error[i] + fold_error.get(i, final_error)
+    return [1 - total_error[i]/(num_trials*num_folds) for i in iterValues]
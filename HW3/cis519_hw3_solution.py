@@ -12,12 +12,255 @@ Original file is located at
 
 import pandas as pd
 import numpy as np
+import scipy.sparse as sp
+from scipy.special import expit, logsumexp, softmax
+import copy
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+"""### Log Loss"""
+
+def logLoss(theta, X, y, regLambda, regNorm, scale = 1, returnCost = True, returnGradient = True):
+    '''
+    Fused cost / gradient kernel shared by LogisticRegression and LogisticRegressionAdagrad
+    Both are computed from a single z = X*theta pass:
+        cost = sum(log(1+exp(z)) - y*z) + regLambda*||theta[1:]||   (1-norm, or squared 2-norm)
+        gradient = X^T (sigmoid(z) - y) + regLambda*sign(theta[1:])  (L1) or regLambda*theta[1:] (L2)
+    log(1+exp(z)) is logaddexp(0, z) and the sigmoid is scipy's expit, so neither overflows for large |z|
+    (the unclipped log(yhat), log(1-yhat) give inf/nan once the sigmoid saturates)
+    With a d-by-K theta (K > 1) the loss is the multinomial (softmax) one, y is the n-by-K one-hot label matrix:
+        cost = sum(logsumexp(z_i) - y_i*z_i) + regularization, gradient = X^T (softmax(z) - y) + regularization
+    Arguments:
+        X is a n-by-d numpy array or scipy.sparse matrix, y an n-by-1 numpy array (n-by-K for the softmax loss)
+        scale multiplies the data term of the cost and gradient (1/b to average over a block of b instances),
+        the regularization term is not scaled
+        returnCost / returnGradient skip the part that is not needed
+    Returns:
+        (cost, gradient), a scalar and a d-by-1 array, None for the part that was skipped
+    '''
+    if regNorm not in (1, 2):
+        raise ValueError("regNorm must be 1 or 2, got " + str(regNorm))
+    z = X.dot(theta)    # n-by-1 (n-by-K), the only pass over X for the cost
+    multinomial = theta.shape[1] > 1
+    cost = None
+    gradient = None
+    if returnCost:
+        if multinomial:
+            cost = scale * float(np.sum(logsumexp(z, axis=1)) - np.sum(np.multiply(y, z)))
+        else:
+            cost = scale * float(np.sum(np.logaddexp(0, z) - np.multiply(y, z)))   # theta zero is not regularized
+        if regNorm == 1:
+            cost += regLambda * float(np.sum(np.absolute(theta[1:])))
+        else:
+            cost += regLambda * float(np.sum(np.square(theta[1:])))
+    if returnGradient:
+        residual = softmax(z, axis=1) if multinomial else expit(z)     # yhat, then yhat - y in place
+        residual -= y
+        gradient = np.asarray(X.T.dot(residual))      # the first row of X is 1
+        if scale != 1:
+            gradient *= scale
+        if regNorm == 1:
+            gradient[1:] += regLambda * np.sign(theta[1:])    # subgradient 0 at theta_j = 0
+        else:
+            gradient[1:] += regLambda * theta[1:]
+    return cost, gradient
+
+
+def squaredSpectralNorm(X, maxIters = 100, tol = 1E-4, margin = 1.05):
+    '''
+    Estimates ||X||_2^2, the largest eigenvalue of X^T X, by power iteration on v -> X^T (X v)
+    Each iteration is two matrix-vector products instead of the full SVD of np.linalg.norm(X, 2)
+    Power iteration approaches the eigenvalue from below, the estimate is multiplied by margin so that
+    a step size of 1/estimate stays on the safe side
+    Arguments:
+        X is a n-by-d numpy array
+        maxIters / tol bound the iterations, the loop stops when the estimate changes by less than tol (relative)
+    '''
+    v = np.random.default_rng(0).standard_normal(X.shape[1])    # fixed start, the estimate is reproducible
+    estimate = 0
+    for iter in range(maxIters):
+        v /= np.linalg.norm(v)
+        Xv = np.dot(X, v)
+        estimate_old, estimate = estimate, np.dot(Xv, Xv)     # Rayleigh quotient v^T X^T X v
+        v = np.dot(X.T, Xv)
+        if estimate - estimate_old <= tol * estimate:
+            break
+    return margin * estimate
+
+
+def fitOneVsRest(models, X, y, theta, n_jobs = None):
+    '''
+    One-vs-rest training: models[k].solve(X, y[:, k], theta[:, k]) fits the binary problem "class k or not"
+    The K fits run in a thread pool of n_jobs threads (None uses the executor default), the threads share X
+    (no copy per class) and the numpy products release the GIL, so the classes are trained concurrently
+    Arguments:
+        models is a list of K private copies of the model (one per class, they must not share any state)
+        X is the preprocessed n-by-d numpy array, y the n-by-K one-hot label matrix, theta the initial d-by-K theta
+    Returns:
+        the d-by-K theta, column k is the binary theta of class k
+    '''
+    def fitClass(k):
+        return models[k].solve(X, y[:, [k]], theta[:, [k]])
+
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        thetas = list(executor.map(fitClass, range(len(models))))
+    return np.hstack(thetas)
+
+
+def encodeLabels(y):
+    '''
+    Multiclass labels (any type) to an n-by-K one-hot matrix
+    Returns:
+        the sorted array of the K classes and the n-by-K boolean one-hot matrix
+    '''
+    classes, codes = np.unique(np.asarray(y).ravel(), return_inverse=True)
+    return classes, codes[:, None] == np.arange(len(classes))
+
+"""### Feature Scaling"""
+
+def scaleFeatures(model, X_fit):
+    '''
+    Standardizes the feature columns X_fit[:, 1:] in place with model.X_train_mean / model.X_train_std
+    The statistics are computed from X_fit first if the model has none yet (same as StandardScaler,
+    ddof = 0 and constant columns are left unscaled), so they are computed once per fit and cached
+    '''
+    if model.X_train_mean is None:
+        model.X_train_mean = X_fit[:, 1:].mean(0)
+        std = X_fit[:, 1:].std(0)
+        std[std == 0] = 1
+        model.X_train_std = std
+    X_fit[:, 1:] -= model.X_train_mean
+    X_fit[:, 1:] /= model.X_train_std
+
+
+def foldScaling(theta, mean, std):
+    '''
+    Converts a d-by-K theta trained on (X - mean)/std into the theta for the raw X:
+        theta_j / std_j for the features, theta_0 - sum_j mean_j*theta_j/std_j for the bias
+    so scoring raw features is a single dot product with no transform pass
+    '''
+    folded = np.empty_like(theta)
+    folded[1:] = theta[1:] / std[:, None]
+    folded[0] = theta[0] - np.dot(mean, folded[1:])
+    return folded
+
+
+def unfoldScaling(theta, mean, std):
+    '''
+    Inverse of foldScaling, the theta for the raw X back to the standardized space (used to warm start a fit)
+    '''
+    unfolded = np.empty_like(theta)
+    unfolded[1:] = theta[1:] * std[:, None]
+    unfolded[0] = theta[0] + np.dot(mean, theta[1:])
+    return unfolded
+
+"""### Stopping Criteria"""
+
+class StoppingController:
+
+    def __init__(self, costTol = None, gradTol = None, validationData = None, patience = 5, restoreBest = True,
+                 maxTime = None, maxIters = None, checkEvery = 1):
+        '''
+        Early stopping rules shared by every trainer of LogisticRegression and LogisticRegressionAdagrad
+        (passed as their stopping argument), on top of the ||theta_old - theta_new|| <= epsilon test
+        Arguments:
+            costTol stops when the relative change of the regularized cost between two checks is <= costTol
+            gradTol stops when the norm of the gradient of the cost is <= gradTol
+            validationData is an optional (X_val, y_val) pair in the format given to fit, training stops when the
+              validation log loss has not improved for patience checks in a row
+            restoreBest returns the theta with the best validation loss instead of the last one
+            maxTime is a wall-clock budget in seconds, maxIters a budget of iterations (epochs for Adagrad)
+            checkEvery is the cadence (in iterations) of the cost, gradient and validation checks,
+              the budgets are checked every iteration
+        Attributes:
+            reason_ is the criterion that stopped the last fit (None if the trainer stopped by itself)
+            bestLoss_ / bestIter_ are the best validation loss and the iteration it was reached at
+        '''
+        self.costTol = costTol
+        self.gradTol = gradTol
+        self.validationData = validationData
+        self.patience = patience
+        self.restoreBest = restoreBest
+        self.maxTime = maxTime
+        self.maxIters = maxIters
+        self.checkEvery = checkEvery
+        self.reason_ = None
+        self.bestLoss_ = None
+        self.bestIter_ = None
+
+    def start(self, model, column = None):
+        '''
+        Resets the state at the beginning of a fit, the validation data is preprocessed once with model.prepareData
+        column selects the binary label of one class for a one-vs-rest copy of a multiclass model
+        '''
+        self.reason_ = None
+        self.bestLoss_ = np.inf
+        self.bestIter_ = None
+        self.bestTheta_ = None
+        self.lastCost_ = None
+        self.badChecks_ = 0
+        self.startTime_ = time.perf_counter()
+        self.X_val_ = None
+        if self.validationData is not None:
+            X_val, y_val = self.validationData
+            if model.classes_ is not None:  # multiclass labels -> one-hot, in the column order of model.classes_
+                y_val = np.asarray(y_val).ravel()[:, None] == model.classes_
+                if column is not None:
+                    y_val = y_val[:, [column]]
+            self.X_val_, self.y_val_ = model.prepareData(X_val, y_val)
+
+    def shouldStop(self, iter, theta, model, X, y):
+        '''
+        Called by the trainer after iteration iter (0-based) with the current theta and the preprocessed X, y
+        Returns:
+            True if training should stop, the reason is stored in self.reason_
+        '''
+        if self.maxIters is not None and iter + 1 >= self.maxIters:
+            self.reason_ = 'maxIters'
+            return True
+        if self.maxTime is not None and time.perf_counter() - self.startTime_ >= self.maxTime:
+            self.reason_ = 'maxTime'
+            return True
+        if (iter + 1) % self.checkEvery != 0:
+            return False
+        if self.costTol is not None or self.gradTol is not None:   # cost and gradient from one pass over X
+            cost, gradient = logLoss(theta, X, y, model.regLambda, model.regNorm,
+                                     returnCost=self.costTol is not None, returnGradient=self.gradTol is not None)
+            if self.costTol is not None:
+                if self.lastCost_ is not None and abs(self.lastCost_ - cost) <= self.costTol * max(abs(self.lastCost_), 1E-12):
+                    self.reason_ = 'costTol'
+                    return True
+                self.lastCost_ = cost
+            if self.gradTol is not None and np.linalg.norm(gradient) <= self.gradTol:
+                self.reason_ = 'gradTol'
+                return True
+        if self.X_val_ is not None:
+            loss, _ = logLoss(theta, self.X_val_, self.y_val_, 0, model.regNorm, returnGradient=False)
+            if loss < self.bestLoss_:
+                self.bestLoss_, self.bestIter_, self.bestTheta_ = loss, iter, theta.copy()
+                self.badChecks_ = 0
+            else:
+                self.badChecks_ += 1
+                if self.badChecks_ >= self.patience:
+                    self.reason_ = 'patience'
+                    return True
+        return False
+
+    def finalTheta(self, theta):
+        '''
+        The theta the trainer should return, the best validation theta if restoreBest is set
+        '''
+        if self.restoreBest and self.bestTheta_ is not None:
+            return self.bestTheta_.astype(theta.dtype, copy=True)
+        return theta
 
 """### Logistic Regression"""
 
 class LogisticRegression:
 
-    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None):
+    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None, solver='gd',
+                 costEvery = None, callback = None, dtype = np.float64, multiClass = None, n_jobs = None, stopping = None,
+                 standardize = False):
         '''
         Constructor
         Arguments:
@@ -27,13 +270,45 @@ class LogisticRegression:
         	epsilon is the convergence parameter
         	maxNumIters is the maximum number of iterations to run
           initTheta is the initial theta value. This is an optional argument
+          solver is the optimizer used by fit: 'gd' (gradient descent), 'newton' (Newton/IRLS, L2 only),
+            'lbfgs' (quasi-Newton L-BFGS, L1 or L2) or 'fista' (accelerated proximal gradient, L1 only)
+          costEvery is how often (in iterations) the cost is evaluated and recorded in cost_history_, None to never evaluate it
+          callback is an optional function callback(iter, theta, cost) called whenever the cost is evaluated
+          dtype is the floating point type used for training and scoring (np.float64 or np.float32)
+          multiClass is None for 0/1 labels, 'multinomial' (softmax, d-by-K theta, 'gd' and 'lbfgs' only) or
+            'ovr' (one binary model per class, fitted in parallel) for labels with K classes of any type
+          n_jobs is the number of threads used by 'ovr' (None uses the executor default)
+          stopping is an optional StoppingController with early stopping rules (cost, gradient, validation, budgets)
+          standardize makes fit standardize X itself: the mean / standard deviation are kept in X_train_mean / X_train_std
+            and folded into theta at the end of training, so predict and predict_proba take the raw features
         '''
+        if solver not in ('gd', 'newton', 'lbfgs', 'fista'):
+            raise ValueError("solver must be 'gd', 'newton', 'lbfgs' or 'fista', got " + str(solver))
+        if solver == 'newton' and regNorm != 2:
+            raise ValueError("solver 'newton' only supports regNorm=2")
+        if solver == 'fista' and regNorm != 1:
+            raise ValueError("solver 'fista' only supports regNorm=1")
+        if multiClass not in (None, 'multinomial', 'ovr'):
+            raise ValueError("multiClass must be None, 'multinomial' or 'ovr', got " + str(multiClass))
+        if multiClass == 'multinomial' and solver not in ('gd', 'lbfgs'):
+            raise ValueError("multiClass 'multinomial' only supports solver 'gd' or 'lbfgs', use 'ovr' instead")
         self.alpha = alpha
         self.regLambda = regLambda
         self.regNorm = regNorm
         self.epsilon = epsilon
         self.maxNumIters = maxNumIters
         self.theta = initTheta  # give the initial theta to the theta
+        self.solver = solver
+        self.costEvery = costEvery
+        self.callback = callback
+        self.dtype = np.dtype(dtype)
+        self.multiClass = multiClass
+        self.n_jobs = n_jobs
+        self.stopping = stopping
+        self.standardize = standardize
+        self.classes_ = None      # labels of the K classes (multiClass only), column k of theta scores classes_[k]
+        self.n_iter_ = None       # number of iterations run by the last fit
+        self.cost_history_ = []   # (iter, cost) pairs recorded during the last fit
         self.X_train_mean = None  # mean value of standardization
         self.X_train_std = None   # standard deviation
 
@@ -49,16 +324,7 @@ class LogisticRegression:
         Returns:
             a scalar value of the cost  ** make certain you're not returning a 1 x 1 matrix! **
         '''
-        z = np.dot(X, theta)
-        yhat = self.sigmoid(z)  # n-by-1 vector h_theta
-        # the theta zero is not regularized, using L2 norm
-        if self.regNorm == 1:   # 1st Norm for regularization
-            Lreg = -1 * (np.dot(y.T, np.log(yhat)) + np.dot((1 - y).T, np.log(1-yhat))) + regLambda * (np.linalg.norm(theta[1:], ord=1))
-        elif self.regNorm == 2: # 2nd Norm for regularization
-            Lreg = -1 * (np.dot(y.T, np.log(yhat)) + np.dot((1 - y).T, np.log(1-yhat))) + regLambda * ((np.linalg.norm(theta[1:]))**2)
-        else:
-            print("regNorm is not defined")
-        cost_value = Lreg.tolist()[0][0]    # convert the matrix to scalar
+        cost_value, _ = logLoss(theta, X, y, regLambda, self.regNorm, returnGradient=False)
         return cost_value
     
     
@@ -72,17 +338,7 @@ class LogisticRegression:
         Returns:
             the gradient, an d-dimensional vector
         '''
-        n, d = X.shape      # theta is d shape
-        z = np.dot(X, theta)
-        yhat = self.sigmoid(z)  # n-by-1 vector h_theta
-        gradient = np.zeros((d, 1))
-        # extract the alpha outside of the gradient, and use different formula for gradient
-        if self.regNorm == 1:  # L1
-          gradient = np.dot(np.transpose(X), (yhat-y))      # the first row of X is 1
-          gradient[1:] = gradient[1:] + regLambda * theta[1:]/np.absolute(theta[1:]) # regularization term
-        elif self.regNorm == 2: #L2 
-          gradient = np.dot(np.transpose(X), (yhat-y))      # the first row of X is 1
-          gradient[1:] = gradient[1:] + regLambda * theta[1:] # regularization term
+        _, gradient = logLoss(theta, X, y, regLambda, self.regNorm, returnCost=False)
         return gradient    # include the negative into the gradient
     
     def hasConverged(self, theta_new, theta_old):
@@ -93,27 +349,273 @@ class LogisticRegression:
         :return: True or False
         '''
         if np.linalg.norm(theta_old-theta_new) <= self.epsilon:
-            print('Has converged!')
             return True
         else:
             return False
 
-    def gradientDescent(self, X, y, theta):     # the X should be preprocessed
+    def gradientDescent(self, X, y, theta, maxNumIters=None):     # the X should be preprocessed
         '''
         This function is for implementing the gradient descent to update the theta
         X: proprocessed n by d
         y: labels
         theta
+        maxNumIters overrides self.maxNumIters when given
+        The loop does not print and works in preallocated z / yhat / gradient buffers,
+        the cost is only evaluated every self.costEvery iterations (see recordCost)
+        A d-by-K theta (K > 1) is trained on the softmax loss, y is then the n-by-K one-hot matrix
         '''
         n, d = X.shape
+        K = theta.shape[1]
+        theta = theta.copy()
+        z = np.empty((n, K), dtype=X.dtype)        # X*theta, then the sigmoid (softmax) and the residual yhat - y in place
+        gradient = np.empty((d, K), dtype=X.dtype)
+        reg = np.empty((d - 1, K), dtype=X.dtype)  # regularization term of theta[1:]
+        if maxNumIters is None:
+            maxNumIters = self.maxNumIters
+        for iter in range(maxNumIters):
+            np.dot(X, theta, out=z)
+            if K > 1:
+                z -= z.max(axis=1, keepdims=True)   # softmax, exp does not overflow after the shift
+                np.exp(z, out=z)
+                z /= z.sum(axis=1, keepdims=True)
+            else:
+                expit(z, out=z)                 # yhat = 1 / (1 + exp(-z)) without overflow
+            z -= y
+            np.dot(X.T, z, out=gradient)        # the first row of X is 1
+            if self.regNorm == 1:
+                np.sign(theta[1:], out=reg)
+            else:
+                np.copyto(reg, theta[1:])
+            reg *= self.regLambda
+            gradient[1:] += reg
+            gradient *= self.alpha              # gradient is now the step theta_old - theta
+            theta -= gradient
+            self.recordCost(iter, theta, X, y)
+            if iter > 0 and np.linalg.norm(gradient) <= self.epsilon:
+                break   # the gradient descent has converged, ||theta_old - theta|| <= epsilon
+            if self.stopping is not None and self.stopping.shouldStop(iter, theta, self, X, y):
+                break
+        self.n_iter_ = iter + 1
+        return theta
+
+    def recordCost(self, iter, theta, X, y):
+        '''
+        Evaluates the cost every self.costEvery iterations (never if costEvery is None),
+        stores it in self.cost_history_ and passes it to self.callback(iter, theta, cost)
+        '''
+        if self.costEvery is None or iter % self.costEvery != 0:
+            return
+        cost = self.computeCost(theta, X, y, self.regLambda)
+        self.cost_history_.append((iter, cost))
+        if self.callback is not None:
+            self.callback(iter, theta, cost)
+
+    def newtonMethod(self, X, y, theta):     # the X should be preprocessed
+        '''
+        Newton / IRLS update of theta for the L2 regularized objective
+        X: proprocessed n by d
+        y: labels
+        theta
+        Each step solves (X^T W X + regLambda*I) step = gradient with W = diag(yhat*(1-yhat)),
+        the bias theta_0 is not regularized (same as computeGradient). The step is halved until the
+        objective decreases enough, otherwise Newton diverges on (nearly) separable data
+        '''
+        n, d = X.shape
+        reg = self.regLambda * np.ones(d, dtype=X.dtype)
+        reg[0] = 0      # theta zero is not regularized
+
+        def objective(theta):   # regLambda/2 matches computeGradient
+            return logLoss(theta, X, y, self.regLambda / 2, 2, returnGradient=False)[0]
+
         for iter in range(self.maxNumIters):
             theta_old = theta.copy()
-            theta = theta - self.alpha*self.computeGradient(theta, X, y, self.regLambda)     # gradient is negative, +
-            print('Cost is: '+str(self.computeCost(theta, X, y, self.regLambda)))    # indicator of Cost value
-            if iter > 0 and self.hasConverged(theta, theta_old) is True:
-                break   # the gradient descent has converged
+            gradient = self.computeGradient(theta, X, y, self.regLambda)
+            yhat = self.sigmoid(np.dot(X, theta))
+            w = np.multiply(yhat, 1 - yhat)     # n-by-1 IRLS weights
+            hessian = np.dot(X.T, np.multiply(X, w)) + np.diag(reg)
+            try:
+                step = np.linalg.solve(hessian, gradient)
+            except np.linalg.LinAlgError:     # singular hessian, e.g. separable data with regLambda = 0
+                step = np.linalg.lstsq(hessian, gradient, rcond=None)[0]
+            cost = objective(theta)
+            decrease = np.sum(np.multiply(gradient, step))
+            t = 1
+            while t > 1E-10 and objective(theta - t * step) > cost - 1E-4 * t * decrease:   # backtracking line search
+                t = t / 2
+            theta = theta - t * step
+            self.recordCost(iter, theta, X, y)
+            if self.hasConverged(theta, theta_old) is True:
+                break
+            if self.stopping is not None and self.stopping.shouldStop(iter, theta, self, X, y):
+                break
+        self.n_iter_ = iter + 1
+        return theta
+
+    def lbfgs(self, X, y, theta):     # the X should be preprocessed
+        '''
+        Quasi-Newton (L-BFGS) update of theta, works for both L1 and L2
+        X: proprocessed n by d
+        y: labels
+        theta
+        For L1 theta is split as theta = p - q with p, q >= 0, so the objective is smooth and
+        L-BFGS-B can handle it with bound constraints (the bias theta_0 is left unbounded)
+        A d-by-K theta is optimized on the softmax loss as one vector of m = d*K variables
+        '''
+        from scipy.optimize import minimize
+        n, d = X.shape
+        K = theta.shape[1]
+        m = d * K
+        theta = theta.astype(np.float64).reshape(m)     # scipy optimizes in double precision, row j is feature j
+        penalty = self.regLambda * np.ones(m)
+        penalty[:K] = 0   # theta zero is not regularized
+
+        if self.regNorm == 2:
+            # the gradient regLambda*theta is the gradient of regLambda/2*||theta||^2
+            def objective(theta_vec):
+                cost, gradient = logLoss(theta_vec.reshape(d, K), X, y, 0, 2)    # cost and gradient from one X*theta pass
+                cost += np.sum(penalty / 2 * np.square(theta_vec))
+                return cost, gradient.ravel() + penalty * theta_vec
+            x0 = theta
+            bounds = None
+        elif self.regNorm == 1:
+            def objective(pq):
+                cost, gradient = logLoss((pq[:m] - pq[m:]).reshape(d, K), X, y, 0, 1)
+                cost += np.sum(penalty * (pq[:m] + pq[m:]))
+                gradient = gradient.ravel()
+                return cost, np.concatenate((gradient + penalty, -gradient + penalty))
+            x0 = np.concatenate((np.maximum(theta, 0), np.maximum(-theta, 0)))
+            x0[:K], x0[m:m+K] = theta[:K], 0     # the bias lives in p only
+            bounds = ([(None, None)] * K + [(0, None)] * (m - K)) + ([(0, 0)] * K + [(0, None)] * (m - K))
+        else:
+            raise ValueError("regNorm is not defined")
+        iters = [x0]
+
+        def record(x):
+            theta_mat = (x[:m] - x[m:] if self.regNorm == 1 else x).reshape(d, K)
+            self.recordCost(len(iters) - 1, theta_mat, X, y)
+            iters.append(x.copy())
+            if self.stopping is not None and self.stopping.shouldStop(len(iters) - 2, theta_mat, self, X, y):
+                raise StopIteration     # scipy >= 1.11 ends the minimization at x, older versions let it through
+
+        try:
+            result = minimize(objective, x0, jac=True, method='L-BFGS-B', bounds=bounds, callback=record,
+                              options={'maxiter': self.maxNumIters, 'gtol': self.epsilon})
+            x, self.n_iter_ = result.x, result.nit
+        except StopIteration:
+            x, self.n_iter_ = iters[-1], len(iters) - 1
+        if self.regNorm == 1:
+            theta = x[:m] - x[m:]
+        else:
+            theta = x
+        return theta.reshape(d, K).astype(X.dtype)
+
+
+    def proximalGradient(self, X, y, theta):     # the X should be preprocessed
+        '''
+        FISTA (accelerated proximal gradient) update of theta for the L1 regularized objective
+        X: proprocessed n by d
+        y: labels
+        theta
+        Each step is a gradient step on the log loss followed by soft-thresholding, so coefficients become exactly 0
+        (momentum is restarted when it stops helping). The step size starts at 1/L (L = ||X||_2^2 / 4, see squaredSpectralNorm),
+        grows when possible and is halved until the quadratic upper bound of the log loss holds (backtracking line search),
+        1/L is the worst case curvature and far too small near the optimum of nearly separable data. Only the active set (theta_0, the nonzero
+        coefficients and the KKT violators |gradient_j| > regLambda) is updated, zero columns are dropped
+        every few iterations and the full gradient is only checked once the active set has converged
+        Convergence is measured on the gradient mapping (point - proximal step) / step, which is 0 exactly at the
+        optimum: the active set stops when its mapping has norm <= epsilon, the fit only returns once the mapping
+        over all the coordinates does
+        '''
+        n, d = X.shape
+        min_step = 4 / squaredSpectralNorm(X)     # 1/L always satisfies the line search condition
+        step = min_step
+        theta = theta.copy()
+
+        def proximalStep(point, gradient, step):
+            point_new = point - step * gradient
+            point_new[1:] = np.sign(point_new[1:]) * np.maximum(np.absolute(point_new[1:]) - step * self.regLambda, 0)   # first entry is theta zero
+            return point_new
+
+        def logLossIncrease(z_new, z):  # log loss at the scores z_new minus the log loss at z, summed term by term (no cancellation of two large sums)
+            return np.sum(np.logaddexp(0, z_new) - np.logaddexp(0, z) - np.multiply(y, z_new - z))
+
+        iter = 0
+        active = np.arange(d)
+        while iter < self.maxNumIters:
+            X_active = X[:, active]        # columns of the active set, rebuilt only when it changes
+            v = theta[active]              # extrapolated point
+            z = np.dot(X_active, v)        # X*v
+            z_theta = z                    # X*theta of the last iterate
+            t = 1
+            shrunk = False
+            stopped = False
+            while iter < self.maxNumIters:
+                theta_active_old = theta[active]
+                z_theta_old = z_theta
+                gradient = np.dot(X_active.T, self.sigmoid(z) - y)
+                step = step * 2     # try a longer step first
+                while True:
+                    theta_active = proximalStep(v, gradient, step)      # active[0] is theta zero
+                    diff = theta_active - v
+                    z_theta = np.dot(X_active, theta_active)
+                    if step <= min_step or logLossIncrease(z_theta, z) <= np.sum(gradient * diff) + np.sum(np.square(diff)) / (2 * step):
+                        break
+                    step = max(step / 2, min_step)
+                mapping_norm = np.linalg.norm(diff) / step     # gradient mapping at v
+                if np.sum((v - theta_active) * (theta_active - theta_active_old)) > 0:
+                    t = 1       # adaptive restart, the momentum is pointing uphill
+                t_new = (1 + np.sqrt(1 + 4 * t * t)) / 2
+                momentum = (t - 1) / t_new
+                v = theta_active + momentum * (theta_active - theta_active_old)
+                z = z_theta + momentum * (z_theta - z_theta_old)     # X*v without another product with X
+                t = t_new
+                theta[active] = theta_active
+                self.recordCost(iter, theta, X, y)
+                iter += 1
+                if mapping_norm <= self.epsilon:
+                    break
+                if self.stopping is not None and self.stopping.shouldStop(iter - 1, theta, self, X, y):
+                    stopped = True
+                    break
+                if iter % 10 == 0 and np.any(theta_active[1:] == 0):     # drop the zero coefficients
+                    active = np.concatenate(([0], active[1:][theta_active[1:, 0] != 0]))
+                    shrunk = True
+                    break
+            if stopped:
+                break
+            if shrunk:
+                continue
+            # the active set has converged, check the gradient mapping of all the coordinates and add
+            # the zero coefficients that violate the optimality conditions (|gradient_j| > regLambda)
+            gradient = np.dot(X.T, self.sigmoid(np.dot(X, theta)) - y)
+            theta_trial = proximalStep(theta, gradient, step)
+            if np.linalg.norm(theta - theta_trial) / step <= self.epsilon:
+                break
+            violators = np.flatnonzero((theta[1:, 0] == 0) & (theta_trial[1:, 0] != 0)) + 1
+            active = np.union1d(active, violators)
+        self.n_iter_ = iter
         return theta
 
+    def prepareData(self, X, y):
+        '''
+        Converts the Pandas X and y to contiguous numpy arrays in self.dtype
+        and adds the x_i0 = 1 constant feature as the first column of X
+        With self.standardize the features are standardized (the statistics are fitted on the first call)
+        Returns:
+            X_fit an n-by-(d+1) numpy array, y_fit an n-by-1 numpy array
+        '''
+        # process the X set and standardization
+        X_copy = np.asarray(X, dtype=self.dtype)    # convert df to np
+        y_copy = np.asarray(y, dtype=self.dtype)
+
+        n = len(y)
+        X_fit = np.empty((n, X_copy.shape[1] + 1), dtype=self.dtype)   # contiguous n by d, the first column is 1
+        X_fit[:, 0] = 1
+        X_fit[:, 1:] = X_copy
+        if self.standardize:    # in place, X_fit is already a private copy
+            scaleFeatures(self, X_fit)
+        y_fit = y_copy.reshape(n, -1)     # n-by-1, n-by-K for one-hot multiclass labels
+        return X_fit, y_fit
 
     def fit(self, X, y):
         '''
@@ -125,40 +627,101 @@ class LogisticRegression:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before fit() is called.
         '''
-        # process the X set and standardization
-        X_copy = X.copy().to_numpy()    # in case the new operation affects the original X, and convert df to np
-        y_copy = y.copy().to_numpy()
-
-        n = len(y)
-        # self.X_train_mean = X_copy.mean(0)
-        # self.X_train_std = X_copy.std(0)
-        # X_scaled = (X_copy - X_copy.mean(0))/X_copy.std(0)
-        X_fit = np.c_[np.ones((n, 1)), X_copy]  # add the first column
-
+        if self.multiClass is not None:     # labels of any type -> n-by-K one-hot, theta becomes d-by-K
+            self.classes_, y = encodeLabels(y)
+        if self.standardize:
+            self.X_train_mean = None    # the scaling statistics are refitted on this training set
+        X_fit, y_fit = self.prepareData(X, y)
         n, d = X_fit.shape          # now the X has been added the first column
-        y_fit = y_copy.reshape(n, 1)
+        K = y_fit.shape[1]
 
         if self.theta is None:  # initialize the theta
-            self.theta = np.matrix(np.random.rand(d, 1) - 0.5)    # why initial with random integer rather than zeros????
+            self.theta = np.random.rand(d, K) - 0.5    # why initial with random integer rather than zeros????
+        elif self.standardize:  # a given theta scores raw features, train from its standardized equivalent
+            self.theta = unfoldScaling(np.asarray(self.theta, dtype=self.dtype).reshape(d, K), self.X_train_mean, self.X_train_std)
+        self.theta = np.asarray(self.theta, dtype=self.dtype).reshape(d, K)
 
         # theta_copy = self.theta.copy()    # copy the theta (not sure if necessary)
-        self.theta = self.gradientDescent(X_fit, y_fit, self.theta)
+        self.cost_history_ = []
+        if self.multiClass == 'ovr':
+            models = [copy.copy(self) for k in range(K)]
+            for k, model in enumerate(models):
+                model.cost_history_ = []    # the copies must not share the history list
+                if self.stopping is not None:
+                    model.stopping = copy.copy(self.stopping)
+                    model.stopping.start(model, k)
+            self.theta = fitOneVsRest(models, X_fit, y_fit, self.theta, self.n_jobs)
+            self.n_iter_ = max(model.n_iter_ for model in models)
+        else:
+            if self.stopping is not None:
+                self.stopping.start(self)
+            self.theta = self.solve(X_fit, y_fit, self.theta)
+        if self.standardize:
+            self.theta = foldScaling(self.theta, self.X_train_mean, self.X_train_std)
+
+    def solve(self, X, y, theta):
+        '''
+        Runs self.solver on the preprocessed X, y starting from theta
+        Returns:
+            the trained theta
+        '''
+        if self.solver == 'newton':
+            theta = self.newtonMethod(X, y, theta)
+        elif self.solver == 'lbfgs':
+            theta = self.lbfgs(X, y, theta)
+        elif self.solver == 'fista':
+            theta = self.proximalGradient(X, y, theta)
+        else:
+            theta = self.gradientDescent(X, y, theta)
+        if self.stopping is not None:
+            theta = self.stopping.finalTheta(theta)     # best validation theta if restoreBest
+        return theta
+
+    def partial_fit(self, X, y, numIters = 1):
+        '''
+        Updates the model with numIters gradient descent steps on a chunk of data,
+        theta is kept between calls so the model can be trained on streaming chunks
+        Arguments:
+            X is a n-by-d Pandas data frame (or numpy array) chunk
+            y is an n-by-1 Pandas data frame (or numpy array) chunk
+            numIters is the number of steps taken on the chunk
+        Note:
+            the steps are always gradient descent steps with self.alpha, whatever self.solver is, on the
+            gradient averaged over the chunk (as in the AdaGrad blocks), so the step does not grow with the chunk size
+            only 0/1 labels are supported (multiClass None)
+        '''
+        if self.multiClass is not None:
+            raise ValueError("partial_fit only supports 0/1 labels (multiClass=None)")
+        X_fit, y_fit = self.prepareData(X, y)
+        n, d = X_fit.shape
+        if self.theta is None:  # first chunk, initialize the theta
+            self.theta = np.random.rand(d, 1) - 0.5
+        elif self.standardize:
+            self.theta = unfoldScaling(np.asarray(self.theta, dtype=self.dtype).reshape(d, 1), self.X_train_mean, self.X_train_std)
+        self.theta = np.asarray(self.theta, dtype=self.dtype).reshape(d, 1)
+        for iter in range(numIters):
+            _, gradient = logLoss(self.theta, X_fit, y_fit, self.regLambda, self.regNorm, scale=1 / n, returnCost=False)
+            self.theta -= self.alpha * gradient
+        if self.standardize:
+            self.theta = foldScaling(self.theta, self.X_train_mean, self.X_train_std)
 
 
     def predict(self, X):
         '''
         Used the model to predict values for each instance in X
         Arguments:
-            X is a n-by-d Pandas data frame
+            X is a n-by-d Pandas data frame or numpy array
         Returns:
-            an n-by-1 dimensional Pandas data frame of the predictions
+            an n-by-1 dimensional Pandas data frame of the predictions (labels of self.classes_ for multiClass)
         Note:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before predict() is called.
         '''
-        y_raw = self.predict_proba(X)
-        y_pre = y_raw.iloc[:, 0].apply(lambda x: 1 if x >= 0.5 else 0)
-        return y_pre
+        scores = self.decision_function(X)
+        if self.multiClass is not None:     # the class with the largest score, for softmax and one-vs-rest alike
+            return pd.Series(self.classes_[np.argmax(scores, axis=1)])
+        y_pre = (scores >= 0).astype(np.int64)   # sigmoid(z) >= 0.5 is z >= 0
+        return pd.Series(y_pre)
 
     def predict_proba(self, X):
         '''
@@ -167,20 +730,38 @@ class LogisticRegression:
             X is a n-by-d Pandas data frame
         Returns:
             an n-by-1 Pandas data frame of the class probabilities
+            (n-by-K for multiClass, one column per class of self.classes_)
         Note:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before predict_proba() is called.
         '''
-        X_copy = X.copy().to_numpy()
-        print(X_copy.shape)
-        print('=======')
-        n, d = X_copy.shape
-        X_scaled = np.c_[np.ones((n, 1)), X_copy]
-        return pd.DataFrame(self.sigmoid(X_scaled*self.theta))
+        scores = self.decision_function(X)
+        if self.multiClass == 'multinomial':
+            return pd.DataFrame(softmax(scores, axis=1), columns=self.classes_)
+        elif self.multiClass == 'ovr':      # the K binary probabilities, normalized to sum to 1
+            proba = self.sigmoid(scores)
+            return pd.DataFrame(proba / proba.sum(axis=1, keepdims=True), columns=self.classes_)
+        return pd.DataFrame(self.sigmoid(scores))
+
+    def decision_function(self, X):
+        '''
+        Computes the score theta_0 + X*theta[1:] of each instance in X with a single matrix-vector product
+        Arguments:
+            X is a n-by-d Pandas data frame or numpy array
+        Returns:
+            an n-dimensional numpy array of scores (the class probability is sigmoid of the score),
+            n-by-K for a d-by-K multiclass theta
+        Note:
+            Don't assume that X contains the x_i0 = 1 constant feature.
+            Standardization should be optionally done before decision_function() is called.
+        '''
+        theta = self.theta if self.theta.shape[1] > 1 else self.theta[:, 0]     # one product scores every class
+        X_copy = np.asarray(X, dtype=self.dtype)
+        return np.dot(X_copy, theta[1:]) + theta[0]
 
 
     def sigmoid(self, Z):
-      sigmoid = 1 / (1 + np.exp(-Z))
+      sigmoid = expit(Z)    # 1 / (1 + exp(-Z)) without overflow
       return sigmoid
 
 """# Test Logistic Regression 1"""
@@ -204,14 +785,9 @@ def test_logreg1():
 
     n,d = X.shape
 
-    # # Standardize features
-    from sklearn.preprocessing import StandardScaler
-    standardizer = StandardScaler()
-    Xstandardized = pd.DataFrame(standardizer.fit_transform(X))  # compute mean and stdev on training set for standardization
-    
-    # train logistic regression
-    logregModel = LogisticRegression(regLambda = 0.00000001)
-    logregModel.fit(Xstandardized,y)
+    # train logistic regression, the model standardizes the features itself and keeps the mean and stdev
+    logregModel = LogisticRegression(regLambda = 0.00000001, standardize = True)
+    logregModel.fit(X,y)
     
     # Plot the decision boundary
     h = .02  # step size in the mesh
@@ -220,13 +796,9 @@ def test_logreg1():
     y_min = X[X.columns[1]].min() - .5
     y_max = X[X.columns[1]].max() + .5
     xx, yy = np.meshgrid(np.arange(x_min, x_max, h), np.arange(y_min, y_max, h))
-    allPoints = pd.DataFrame(np.c_[xx.ravel(), yy.ravel()])
-    allPoints = pd.DataFrame(standardizer.transform(allPoints))
-    Z = logregModel.predict(allPoints)
-    Z = np.asmatrix(Z.to_numpy())
+    Z = predictGrid(logregModel, xx, yy)
 
     # Put the result into a color plot
-    Z = Z.reshape(xx.shape)
     plt.figure(1, figsize=(8, 6))
     plt.contourf(xx, yy, Z, cmap=plt.cm.Paired)
 
@@ -262,17 +834,46 @@ def mapFeature(X, column1, column2, maxPower = 6):
         an n-by-d2 Pandas data frame, where each row represents the original features augmented with the new features of the corresponding instance
         the first bias row is not added here
     '''
-    X_1 = X[column1]   # the first column of the X, X1
-    X_2 = X[column2]   # the second column of X, X2
-    X_map = pd.concat([X_1,X_2], axis=1)    # define the new X
-    for d in range(1, maxPower):
-      for i in range(d+2): # 0, 1, 2, ..., d+1
-        x_2_new = X_2.pow(i)    # axis 
-        x_1_new = X_1.pow(d+1-i)
-        new_col = x_1_new.multiply(x_2_new)
-        X_map = pd.concat([X_map, new_col], axis=1)
-    print(X_map)
-    return X_map
+    X_1 = X[column1].to_numpy(dtype=np.float64)   # the first column of the X, X1
+    X_2 = X[column2].to_numpy(dtype=np.float64)   # the second column of X, X2
+    n = len(X_1)
+    # exponents of X1 and X2 for every column, in the order X1, X2, then X1**(d+1-i) * X2**i for d = 1..maxPower-1, i = 0..d+1
+    power_1 = [1, 0] + [d+1-i for d in range(1, maxPower) for i in range(d+2)]
+    power_2 = [0, 1] + [i for d in range(1, maxPower) for i in range(d+2)]
+    # power tables X1**0 .. X1**maxPower and X2**0 .. X2**maxPower, computed once
+    table_1 = np.ones((n, maxPower+1))
+    table_2 = np.ones((n, maxPower+1))
+    for p in range(1, maxPower+1):
+        np.multiply(table_1[:, p-1], X_1, out=table_1[:, p])
+        np.multiply(table_2[:, p-1], X_2, out=table_2[:, p])
+    X_map = np.empty((n, len(power_1)))    # preallocated n-by-d2 output
+    for c in range(len(power_1)):   # one column at a time, no n-by-d2 gathered copies of the tables
+        np.multiply(table_1[:, power_1[c]], table_2[:, power_2[c]], out=X_map[:, c])
+    return pd.DataFrame(X_map, index=X.index, columns=range(len(power_1)), copy=False)    # unique labels 0..d2-1, whatever the input names, X_map is not copied
+
+"""# Decision Boundary Grid"""
+
+def predictGrid(model, xx, yy, standardizer = None, polyPower = None, chunkSize = 10000):
+    '''
+    Predicts the class of every point of the mesh (xx, yy) for plotting the decision boundary
+    The mesh is walked in chunks of chunkSize points, each chunk is mapped (mapFeature with polyPower
+    if given), standardized (standardizer.transform if given), scored with model.predict_proba and
+    thresholded with a vectorized comparison straight into Z, so memory is bounded by one chunk
+    Returns:
+        Z, an array of 0/1 predictions with the shape of xx
+    '''
+    Z = np.empty(xx.shape, dtype=np.int32)
+    Z_flat = Z.reshape(-1)      # view, writing into it fills Z
+    xx_flat = xx.ravel()
+    yy_flat = yy.ravel()
+    for start in range(0, len(Z_flat), chunkSize):
+        points = pd.DataFrame(np.c_[xx_flat[start:start + chunkSize], yy_flat[start:start + chunkSize]])
+        if polyPower is not None:
+            points = mapFeature(points, points.columns[0], points.columns[1], polyPower)
+        if standardizer is not None:
+            points = pd.DataFrame(standardizer.transform(points.to_numpy()))
+        Z_flat[start:start + chunkSize] = model.predict_proba(points).to_numpy()[:, 0] >= 0.5
+    return Z
 
 """# Test Logistic Regression 2"""
 
@@ -297,13 +898,8 @@ def test_logreg2():
     # map features into a higher dimensional feature space
     Xaug = mapFeature(X.copy(), X.columns[0], X.columns[1], polyPower)
 
-    # # Standardize features
-    from sklearn.preprocessing import StandardScaler
-    standardizer = StandardScaler()
-    Xaug = pd.DataFrame(standardizer.fit_transform(Xaug))  # compute mean and stdev on training set for standardization
-    
-    # train logistic regression
-    logregModel = LogisticRegressionAdagrad(regLambda = 0.00000001, regNorm=2)      # this line is changed for testing
+    # train logistic regression, the model standardizes the features itself and keeps the mean and stdev
+    logregModel = LogisticRegressionAdagrad(regLambda = 0.00000001, regNorm=2, standardize = True)      # this line is changed for testing
     logregModel.fit(Xaug,y)
     
     # Plot the decision boundary
@@ -314,16 +910,9 @@ def test_logreg2():
     y_max = X[X.columns[1]].max() + .5
     xx, yy = np.meshgrid(np.arange(x_min, x_max, h), np.arange(y_min, y_max, h))
 
-    allPoints = pd.DataFrame(np.c_[xx.ravel(), yy.ravel()])
-    allPoints = mapFeature(allPoints, allPoints.columns[0], allPoints.columns[1], polyPower)
-    allPoints = pd.DataFrame(standardizer.transform(allPoints))
-    Xaug = pd.DataFrame(standardizer.fit_transform(Xaug))  # standardize data
-    
-    Z = logregModel.predict(allPoints)
-    Z = np.asmatrix(Z.to_numpy())
+    Z = predictGrid(logregModel, xx, yy, polyPower=polyPower)
 
     # Put the result into a color plot
-    Z = Z.reshape(xx.shape)
     plt.figure(1, figsize=(8, 6))
     plt.contourf(xx, yy, Z, cmap=plt.cm.Paired)
 
@@ -350,7 +939,9 @@ def test_logreg2():
 
 class LogisticRegressionAdagrad:
 
-    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None):
+    def __init__(self, alpha = 0.01, regLambda=0.01, regNorm=2, epsilon=0.0001, maxNumIters = 10000, initTheta = None, dtype = np.float64,
+                 batchSize = 1, shuffleBlockSize = None, randomState = None, multiClass = None, n_jobs = None, stopping = None,
+                 standardize = False):
         '''
         Constructor
         Arguments:
@@ -360,13 +951,37 @@ class LogisticRegressionAdagrad:
         	epsilon is the convergence parameter
         	maxNumIters is the maximum number of iterations to run
           initTheta is the initial theta value. This is an optional argument
+          dtype is the floating point type used for training and scoring (np.float64 or np.float32)
+          batchSize is the number of instances used for each AdaGrad step (1 is plain per-instance AdaGrad)
+          shuffleBlockSize, if given, shuffles the order of blocks of that many consecutive rows instead of single rows
+          randomState is the seed of the random generator used for the initial theta and the shuffling
+          multiClass is None for 0/1 labels, 'multinomial' (softmax, d-by-K theta, dense X only) or
+            'ovr' (one binary model per class, fitted in parallel) for labels with K classes of any type
+          n_jobs is the number of threads used by 'ovr' (None uses the executor default)
+          stopping is an optional StoppingController with early stopping rules, checked once per epoch
+          standardize makes fit standardize X itself: the mean / standard deviation are kept in X_train_mean / X_train_std
+            and folded into theta at the end of training, so predict and predict_proba take the raw features (dense X only)
         '''
+        if multiClass not in (None, 'multinomial', 'ovr'):
+            raise ValueError("multiClass must be None, 'multinomial' or 'ovr', got " + str(multiClass))
         self.alpha = alpha
         self.regLambda = regLambda
         self.regNorm = regNorm
         self.epsilon = epsilon
         self.maxNumIters = maxNumIters
         self.theta = initTheta  # give the initial theta to the theta
+        self.dtype = np.dtype(dtype)
+        self.batchSize = batchSize
+        self.shuffleBlockSize = shuffleBlockSize
+        self.randomState = randomState
+        self.multiClass = multiClass
+        self.n_jobs = n_jobs
+        self.stopping = stopping
+        self.standardize = standardize
+        self.classes_ = None      # labels of the K classes (multiClass only), column k of theta scores classes_[k]
+        self.rng_ = None          # random generator of the last fit
+        self.G_ = None            # AdaGrad accumulator, kept between partial_fit calls
+        self.n_iter_ = None       # number of epochs run by the last fit
         self.X_train_mean = None  # mean value of standardization
         self.X_train_std = None   # standard deviation
     
@@ -381,43 +996,23 @@ class LogisticRegressionAdagrad:
         Returns:
             a scalar value of the cost  ** make certain you're not returning a 1 x 1 matrix! **
         '''
-        z = np.dot(X, theta)
-        yhat = self.sigmoid(z)  # n-by-1 vector h_theta
-        # the theta zero is not regularized, using L2 norm
-        if self.regNorm == 1:   # 1st Norm for regularization
-            Lreg = -1 * (np.dot(y.T, np.log(yhat)) + np.dot((1 - y).T, np.log(1-yhat))) + regLambda * (np.linalg.norm(theta[1:], ord=1))
-        elif self.regNorm == 2: # 2nd Norm for regularization
-            Lreg = -1 * (np.dot(y.T, np.log(yhat)) + np.dot((1 - y).T, np.log(1-yhat))) + regLambda * ((np.linalg.norm(theta[1:]))**2)
-        else:
-            print("regNorm is not defined")
-        cost_value = Lreg.tolist()[0][0]    # convert the matrix to scalar
+        cost_value, _ = logLoss(theta, X, y, regLambda, self.regNorm, returnGradient=False)
         return cost_value
     
     
     def computeGradient(self, theta, X, y, regLambda):
         '''
-        Computes the gradient of the objective function
+        Computes the gradient of the objective function on a block of instances
         Arguments:
-            X is a n-by-d numpy matrix
-            y is an n-by-1 numpy matrix
+            X is a b-by-d numpy array (or a single d-dimensional instance)
+            y is a b-by-1 numpy array (or a single label), b-by-K one-hot labels for a d-by-K theta
             regLambda is the scalar regularization constant
         Returns:
-            the gradient, an d-dimensional vector
+            the gradient averaged over the b instances, an d-by-1 vector (d-by-K)
         '''
-        X_copy = X.copy()
-        d = len(X_copy)      # theta is d shape d=1 now
-        X_copy = X_copy.reshape((1, d))   # (n,) to (n,1)
-        z = np.dot(X_copy, theta)
-        print('====='+str(z))
-        yhat = self.sigmoid(z)  # one value
-        gradient = np.zeros((d, 1))
-        # extract the alpha outside of the gradient, and use different formula for gradient
-        if self.regNorm == 1:  # L1s
-          gradient = np.dot(X_copy.T, (yhat-y))      # the first row of X is 1
-          gradient[1:] = gradient[1:] + regLambda * theta[1:]/np.absolute(theta[1:]) # regularization term
-        elif self.regNorm == 2: #L2 
-          gradient = np.dot(X_copy.T, (yhat-y))      # the first row of X is 1
-          gradient[1:] = gradient[1:] + regLambda * theta[1:] # regularization term
+        X_block = np.atleast_2d(X)     # a single instance (d,) becomes (1,d)
+        b, d = X_block.shape
+        _, gradient = logLoss(theta, X_block, np.reshape(y, (b, -1)), regLambda, self.regNorm, scale=1 / b, returnCost=False)
         return gradient    # include the negative into the gradient
     
     def hasConverged(self, theta_new, theta_old):
@@ -428,50 +1023,158 @@ class LogisticRegressionAdagrad:
         :return: True or False
         '''
         if np.linalg.norm(theta_old-theta_new) <= self.epsilon:
-            print('Has converged!')
             return True
         else:
             return False
 
+    def shuffledIndex(self, n):
+        '''
+        Draws the order in which the n training rows are visited during one epoch
+        The rows themselves are never moved, only this index array is permuted
+        '''
+        if self.shuffleBlockSize is None or self.shuffleBlockSize <= 1:
+            return self.rng_.permutation(n)
+        block_order = self.rng_.permutation(-(-n // self.shuffleBlockSize))   # ceil(n / block size) blocks
+        index = (block_order[:, None] * self.shuffleBlockSize + np.arange(self.shuffleBlockSize)).ravel()
+        return index[index < n]     # the last block can be shorter
+
     def gradientDescent(self, X, y, theta):     # the X should be preprocessed
         '''
-        This function is for implementing the gradient descent to update the theta
+        This function is for implementing the AdaGrad updates of theta
         X: proprocessed n by d
         y: labels
         theta
+        Every epoch the rows are visited in a shuffled order in blocks of self.batchSize rows, each block
+        is one matrix product and one per-coordinate AdaGrad step (G += g**2, alpha/sqrt(G)) on the log loss
+        gradient, followed by the proximal regularization step of the same per-coordinate rate (see regularize)
         '''
         n, d = X.shape
-        X_copy = X.copy()
-        y_copy = y.copy()
-        dataset = np.concatenate((X_copy, y_copy), axis=1)   # combine the X and y for shuffling
-        G = 0
-        g = 0
-        min_const = 1E-5
+        if self.rng_ is None:
+            self.rng_ = np.random.default_rng(self.randomState)
+        if self.G_ is None:
+            self.G_ = np.zeros(theta.shape, dtype=X.dtype)
+        theta = theta.copy()
         for iter in range(self.maxNumIters):
-            # dataset = np.concatenate((X_copy, y_copy), axis=1)   # combine the X and y for shuffling
-            np.random.shuffle(dataset)  # shuffle the dataset for every outter iteration  # shuffle function
-            y_shuffled = dataset[:, -1]  # separate the last column as y numpy.array
-            X_shuffled = dataset[:, 0:-1]  # drop the y column
             theta_old = theta.copy()  # store the old theta of last outter iteration
-            # G += g          # put this in the end
-            g = np.zeros((d, 1))    # store the gradient
-            # curr_alpha = self.alpha / (np.sqrt(G) + min_const)
-            for ins_num in range(n):  # instance n is number of instances
-                x_temp = X_shuffled[ins_num, :]
-                y_temp = y_shuffled[ins_num]
-                curr_grad = self.computeGradient(theta, x_temp, y_temp, self.regLambda)  # a vector
-                g = g + curr_grad
-                # g += np.linalg.norm(curr_grad) ** 2
-                # curr_alpha = self.alpha / (np.sqrt(G) + min_const)
-                # theta = theta - curr_alpha * self.computeGradient(theta, x_temp, y_temp, self.regLambda)
-            print('==============\nCurrent Iter is:' + str(iter + 1))  # print the iter number
-            G += g
-            curr_alpha = self.alpha / (np.linalg.norm(G, 2) + min_const)
-            theta = theta - curr_alpha * self.computeGradient(theta, x_temp, y_temp, self.regLambda)
+            self.adagradEpoch(X, y, theta)
             if iter > 0 and self.hasConverged(theta, theta_old) is True:
                 break
+            if self.stopping is not None and self.stopping.shouldStop(iter, theta, self, X, y):
+                break
+        self.n_iter_ = iter + 1
         return theta
 
+    def regularize(self, theta, G, steps):
+        '''
+        Applies steps proximal regularization steps to theta (theta zero must not be passed), with the
+        AdaGrad rate rate_j = alpha/(sqrt(G_j)+min_const) of each coordinate:
+            L2: theta_j /= (1 + rate_j*regLambda)**steps
+            L1: theta_j = sign(theta_j) * max(|theta_j| - steps*rate_j*regLambda, 0)   (soft-thresholding)
+        G only accumulates the log loss gradients, so it is constant while a column has a zero gradient and
+        k steps have this closed form: the sparse path applies the steps a column skipped at once, with the
+        same result as k dense steps. A coordinate that has not had a nonzero gradient yet (G_j = 0) has no
+        AdaGrad rate and is not regularized
+        Returns:
+            the regularized theta
+        '''
+        min_const = 1E-5
+        shrink = np.where(G > 0, self.alpha / (np.sqrt(G) + min_const), 0) * self.regLambda
+        if self.regNorm == 1:
+            return np.sign(theta) * np.maximum(np.absolute(theta) - steps * shrink, 0)
+        return theta / np.power(1 + shrink, steps)
+
+    def adagradEpoch(self, X, y, theta):
+        '''
+        One shuffled pass over X in blocks of self.batchSize rows, theta and the
+        per-coordinate accumulator self.G_ are updated in place
+        '''
+        n, d = X.shape
+        if sp.issparse(X):
+            return self.adagradEpochSparse(X, y, theta)
+        min_const = 1E-5
+        index = self.shuffledIndex(n)  # new order for every outter iteration, X and y are not moved
+        for start in range(0, n, self.batchSize):
+            rows = index[start:start + self.batchSize]
+            x_block = X[rows]
+            y_block = y[rows]
+            curr_grad = self.computeGradient(theta, x_block, y_block, 0)  # d by 1, log loss only
+            self.G_ += np.square(curr_grad)
+            theta -= self.alpha / (np.sqrt(self.G_) + min_const) * curr_grad
+            theta[1:] = self.regularize(theta[1:], self.G_[1:], 1)     # theta zero is not regularized
+
+    def adagradEpochSparse(self, X, y, theta):
+        '''
+        adagradEpoch for a scipy.sparse CSR X, every step only touches the nonzero columns of its block
+        The regularization of the other columns is applied just in time: when a column is touched again
+        (or at the end of the epoch) the k steps it skipped are applied at once with regularize(theta_j, G_j, k).
+        The untouched columns have a zero log loss gradient (G_ does not move), so this gives the same
+        theta as adagradEpoch on the dense X, at a cost of O(nnz) instead of O(d) per step
+        '''
+        n, d = X.shape
+        min_const = 1E-5
+        G = self.G_[:, 0]           # flat views, updated in place
+        theta_flat = theta[:, 0]
+        last = np.zeros(d, dtype=np.int64)    # first step whose regularization each column has not received
+        step = 0
+
+        def catchUp(cols, skipped):
+            cols, skipped = cols[cols > 0], skipped[cols > 0]    # theta zero is not regularized
+            theta_flat[cols] = self.regularize(theta_flat[cols], G[cols], skipped)
+
+        indptr, indices, data = X.indptr, X.indices, X.data
+        index = self.shuffledIndex(n)
+        for start in range(0, n, self.batchSize):
+            rows = index[start:start + self.batchSize]
+            b = len(rows)
+            if b == 1:      # a single CSR row is a contiguous slice of indices / data
+                entries = slice(indptr[rows[0]], indptr[rows[0] + 1])
+                cols = indices[entries]
+                values = data[entries]
+                catchUp(cols, step - last[cols])
+                residual = self.sigmoid(np.dot(values, theta_flat[cols])) - y[rows[0], 0]
+                curr_grad = values * residual
+            else:           # gather the entries of the block rows without slicing the CSR matrix
+                lengths = indptr[rows + 1] - indptr[rows]
+                row_of_entry = np.repeat(np.arange(b), lengths)
+                entries = np.arange(lengths.sum()) + np.repeat(indptr[rows] - (np.cumsum(lengths) - lengths), lengths)
+                cols, inverse = np.unique(indices[entries], return_inverse=True)   # nonzero columns of the block
+                values = data[entries]
+                catchUp(cols, step - last[cols])
+                z = np.bincount(row_of_entry, weights=values * theta_flat[cols[inverse]], minlength=b)
+                residual = self.sigmoid(z) - y[rows, 0]
+                curr_grad = np.bincount(inverse, weights=values * residual[row_of_entry], minlength=len(cols)) / b
+            G[cols] += np.square(curr_grad)
+            theta_flat[cols] -= self.alpha / (np.sqrt(G[cols]) + min_const) * curr_grad
+            last[cols] = step   # the regularization of this step follows the log loss step, it is applied by the next catchUp
+            step += 1
+        catchUp(np.arange(d), step - last)      # flush the pending regularization so theta is exact at the end of the epoch
+
+
+    def prepareData(self, X, y):
+        '''
+        Converts the Pandas X and y to contiguous numpy arrays in self.dtype
+        and adds the x_i0 = 1 constant feature as the first column of X
+        With self.standardize the features are standardized (the statistics are fitted on the first call)
+        Returns:
+            X_fit an n-by-(d+1) numpy array (CSR matrix if X is scipy.sparse), y_fit an n-by-1 numpy array
+        '''
+        # process the X set and standardization
+        y_copy = np.asarray(y, dtype=self.dtype)
+        n = len(y)
+        if sp.issparse(X):      # keep sparse data sparse, as CSR with the bias column in front
+            if self.standardize:
+                raise ValueError("standardize needs a dense X, centering would make a sparse X dense")
+            X_fit = sp.hstack([np.ones((n, 1)), X], format='csr', dtype=self.dtype)
+            return X_fit, y_copy.reshape(n, -1)
+        X_copy = np.asarray(X, dtype=self.dtype)    # convert df to np
+
+        X_fit = np.empty((n, X_copy.shape[1] + 1), dtype=self.dtype)   # contiguous n by d, the first column is 1
+        X_fit[:, 0] = 1
+        X_fit[:, 1:] = X_copy
+        if self.standardize:    # in place, X_fit is already a private copy
+            scaleFeatures(self, X_fit)
+        y_fit = y_copy.reshape(n, -1)     # n-by-1, n-by-K for one-hot multiclass labels
+        return X_fit, y_fit
 
     def fit(self, X, y):
         '''
@@ -483,40 +1186,99 @@ class LogisticRegressionAdagrad:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before fit() is called.
         '''
-        # process the X set and standardization
-        X_copy = X.copy().to_numpy()    # in case the new operation affects the original X, and convert df to np
-        y_copy = y.copy().to_numpy()
-
-        n = len(y)
-        # self.X_train_mean = X_copy.mean(0)
-        # self.X_train_std = X_copy.std(0)
-        # X_scaled = (X_copy - X_copy.mean(0))/X_copy.std(0)
-        X_fit = np.c_[np.ones((n, 1)), X_copy]  # add the first column
-
+        if self.multiClass is not None:     # labels of any type -> n-by-K one-hot, theta becomes d-by-K
+            self.classes_, y = encodeLabels(y)
+            if self.multiClass == 'multinomial' and sp.issparse(X):
+                raise ValueError("multiClass 'multinomial' needs a dense X, use 'ovr' for scipy.sparse data")
+        if self.standardize:
+            self.X_train_mean = None    # the scaling statistics are refitted on this training set
+        X_fit, y_fit = self.prepareData(X, y)
         n, d = X_fit.shape          # now the X has been added the first column
-        y_fit = y_copy.reshape(n, 1)
+        K = y_fit.shape[1]
 
+        self.rng_ = np.random.default_rng(self.randomState)
         if self.theta is None:  # initialize the theta
-            self.theta = np.matrix(np.random.rand(d, 1) - 0.5)    # why initial with random integer rather than zeros????
+            self.theta = self.rng_.random((d, K)) - 0.5    # why initial with random integer rather than zeros????
+        elif self.standardize:  # a given theta scores raw features, train from its standardized equivalent
+            self.theta = unfoldScaling(np.asarray(self.theta, dtype=self.dtype).reshape(d, K), self.X_train_mean, self.X_train_std)
+        self.theta = np.asarray(self.theta, dtype=self.dtype).reshape(d, K)
+        self.G_ = np.zeros((d, K), dtype=self.dtype)       # per-coordinate sum of squared gradients
 
         # theta_copy = self.theta.copy()    # copy the theta (not sure if necessary)
-        self.theta = self.gradientDescent(X_fit, y_fit, self.theta)
+        if self.multiClass == 'ovr':
+            models = [copy.copy(self) for k in range(K)]
+            for k, (model, seed) in enumerate(zip(models, self.rng_.integers(2**63, size=K))):
+                model.G_ = None         # every class has its own accumulator and shuffling order
+                model.rng_ = np.random.default_rng(int(seed))
+                if self.stopping is not None:
+                    model.stopping = copy.copy(self.stopping)
+                    model.stopping.start(model, k)
+            self.theta = fitOneVsRest(models, X_fit, y_fit, self.theta, self.n_jobs)
+            self.G_ = np.hstack([model.G_ for model in models])
+            self.n_iter_ = max(model.n_iter_ for model in models)
+        else:
+            if self.stopping is not None:
+                self.stopping.start(self)
+            self.theta = self.solve(X_fit, y_fit, self.theta)
+        if self.standardize:
+            self.theta = foldScaling(self.theta, self.X_train_mean, self.X_train_std)
+
+    def solve(self, X, y, theta):
+        '''
+        Runs the AdaGrad training on the preprocessed X, y starting from theta
+        Returns:
+            the trained theta
+        '''
+        theta = self.gradientDescent(X, y, theta)
+        if self.stopping is not None:
+            theta = self.stopping.finalTheta(theta)     # best validation theta if restoreBest
+        return theta
+
+    def partial_fit(self, X, y, numIters = 1):
+        '''
+        Updates the model with numIters AdaGrad epochs over a chunk of data, theta and the
+        AdaGrad accumulator are kept between calls so the model can be trained on streaming chunks
+        Arguments:
+            X is a n-by-d Pandas data frame (or numpy array) chunk
+            y is an n-by-1 Pandas data frame (or numpy array) chunk
+        Note:
+            only 0/1 labels are supported (multiClass None)
+        '''
+        if self.multiClass is not None:
+            raise ValueError("partial_fit only supports 0/1 labels (multiClass=None)")
+        X_fit, y_fit = self.prepareData(X, y)
+        n, d = X_fit.shape
+        if self.rng_ is None:
+            self.rng_ = np.random.default_rng(self.randomState)
+        if self.theta is None:  # first chunk, initialize the theta
+            self.theta = self.rng_.random((d, 1)) - 0.5
+        elif self.standardize:
+            self.theta = unfoldScaling(np.asarray(self.theta, dtype=self.dtype).reshape(d, 1), self.X_train_mean, self.X_train_std)
+        self.theta = np.asarray(self.theta, dtype=self.dtype).reshape(d, 1)
+        if self.G_ is None:
+            self.G_ = np.zeros((d, 1), dtype=self.dtype)
+        for iter in range(numIters):
+            self.adagradEpoch(X_fit, y_fit, self.theta)
+        if self.standardize:
+            self.theta = foldScaling(self.theta, self.X_train_mean, self.X_train_std)
 
 
     def predict(self, X):
         '''
         Used the model to predict values for each instance in X
         Arguments:
-            X is a n-by-d Pandas data frame
+            X is a n-by-d Pandas data frame or numpy array
         Returns:
-            an n-by-1 dimensional Pandas data frame of the predictions
+            an n-by-1 dimensional Pandas data frame of the predictions (labels of self.classes_ for multiClass)
         Note:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before predict() is called.
         '''
-        y_raw = self.predict_proba(X)
-        y_pre = y_raw.iloc[:, 0].apply(lambda x: 1 if x >= 0.5 else 0)
-        return y_pre
+        scores = self.decision_function(X)
+        if self.multiClass is not None:     # the class with the largest score, for softmax and one-vs-rest alike
+            return pd.Series(self.classes_[np.argmax(scores, axis=1)])
+        y_pre = (scores >= 0).astype(np.int64)   # sigmoid(z) >= 0.5 is z >= 0
+        return pd.Series(y_pre)
 
     def predict_proba(self, X):
         '''
@@ -525,18 +1287,141 @@ class LogisticRegressionAdagrad:
             X is a n-by-d Pandas data frame
         Returns:
             an n-by-1 Pandas data frame of the class probabilities
+            (n-by-K for multiClass, one column per class of self.classes_)
         Note:
             Don't assume that X contains the x_i0 = 1 constant feature.
             Standardization should be optionally done before predict_proba() is called.
         '''
-        X_copy = X.copy().to_numpy()
-        print(X_copy.shape)
-        print('=======')
-        n, d = X_copy.shape
-        X_scaled = np.c_[np.ones((n, 1)), X_copy]
-        return pd.DataFrame(self.sigmoid(X_scaled*self.theta))
+        scores = self.decision_function(X)
+        if self.multiClass == 'multinomial':
+            return pd.DataFrame(softmax(scores, axis=1), columns=self.classes_)
+        elif self.multiClass == 'ovr':      # the K binary probabilities, normalized to sum to 1
+            proba = self.sigmoid(scores)
+            return pd.DataFrame(proba / proba.sum(axis=1, keepdims=True), columns=self.classes_)
+        return pd.DataFrame(self.sigmoid(scores))
+
+    def decision_function(self, X):
+        '''
+        Computes the score theta_0 + X*theta[1:] of each instance in X with a single matrix-vector product
+        Arguments:
+            X is a n-by-d Pandas data frame, numpy array or scipy.sparse matrix
+        Returns:
+            an n-dimensional numpy array of scores (the class probability is sigmoid of the score),
+            n-by-K for a d-by-K multiclass theta
+        Note:
+            Don't assume that X contains the x_i0 = 1 constant feature.
+            Standardization should be optionally done before decision_function() is called.
+        '''
+        theta = self.theta if self.theta.shape[1] > 1 else self.theta[:, 0]     # one product scores every class
+        if sp.issparse(X):
+            return X.tocsr().dot(theta[1:]) + theta[0]
+        X_copy = np.asarray(X, dtype=self.dtype)
+        return np.dot(X_copy, theta[1:]) + theta[0]
 
 
     def sigmoid(self, Z):
-        sigmoid = 1 / (1 + np.exp(-Z))
-        return sigmoid
\ No newline at end of file
+        sigmoid = expit(Z)    # 1 / (1 + exp(-Z)) without overflow
+        return sigmoid
+"""# Test Sparse AdaGrad"""
+
+def test_sparseAdagrad():
+    # the CSR path (lazy regularization) must train the same theta as the dense path,
+    # including the columns that are only touched by a few rows
+    rng = np.random.default_rng(0)
+    n = 200
+    X = np.zeros((n, 4))
+    X[:, 0] = rng.standard_normal(n)                                  # dense column
+    X[rng.choice(n, 60, replace=False), 1] = rng.standard_normal(60)   # 30% of the rows
+    X[rng.choice(n, 5, replace=False), 2] = 1                         # touched by 5 rows only
+    X[rng.choice(n, 1, replace=False), 3] = 1                         # touched by a single row
+    y = (rng.random(n) < 0.5).astype(int)
+
+    for regNorm in [1, 2]:
+        for batchSize in [1, 8]:
+            thetas = []
+            for X_input in [X, sp.csr_matrix(X)]:
+                logregModel = LogisticRegressionAdagrad(regNorm=regNorm, batchSize=batchSize, maxNumIters=3, randomState=0,
+                                                        initTheta=np.array([[0], [.5], [.5], [.5], [.5]]))
+                logregModel.fit(X_input, y)
+                thetas.append(np.asarray(logregModel.theta))
+            print('L' + str(regNorm) + ' batchSize ' + str(batchSize) + ' max |dense - CSR| = ' + str(np.max(np.absolute(thetas[0] - thetas[1]))))
+            assert np.allclose(thetas[0], thetas[1], rtol=0, atol=1E-10)
+
+# test_sparseAdagrad()
+
+"""# Streaming training on large CSV files"""
+
+def computeChunkedStats(filepath, chunkSize = 100000):
+    '''
+    First pass over a headerless CSV (features first, label in the last column), read chunkSize rows at a time
+    Returns:
+        mean and standard deviation of every feature column (same as StandardScaler, ddof = 0),
+        the number of rows and the label of the first row (used as the positive class)
+    Note:
+        the per-chunk means and squared deviations are merged pairwise, so memory stays bounded by one chunk
+    '''
+    n = 0
+    mean = None
+    M2 = None
+    firstLabel = None
+    for chunk in pd.read_csv(filepath, header=None, chunksize=chunkSize):
+        X_chunk = chunk.iloc[:, 0:-1].to_numpy(dtype=np.float64)
+        if firstLabel is None:
+            firstLabel = chunk.iloc[0, -1]
+            mean = np.zeros(X_chunk.shape[1])
+            M2 = np.zeros(X_chunk.shape[1])
+        n_chunk = X_chunk.shape[0]
+        mean_chunk = X_chunk.mean(0)
+        M2_chunk = np.square(X_chunk - mean_chunk).sum(0)
+        delta = mean_chunk - mean
+        total = n + n_chunk
+        mean = mean + delta * n_chunk / total
+        M2 = M2 + M2_chunk + np.square(delta) * n * n_chunk / total
+        n = total
+    std = np.sqrt(M2 / n)
+    std[std == 0] = 1     # constant columns are left unscaled, same as StandardScaler
+    return mean, std, n, firstLabel
+
+
+def readStandardizedChunks(filepath, mean, std, positiveLabel, chunkSize = 100000, dtype = np.float64):
+    '''
+    Later passes over the CSV: yields (X_chunk, y_chunk) numpy arrays of at most chunkSize rows,
+    X_chunk standardized with the given mean / std and y_chunk = 1 where the label equals positiveLabel
+    '''
+    for chunk in pd.read_csv(filepath, header=None, chunksize=chunkSize):
+        X_chunk = chunk.iloc[:, 0:-1].to_numpy(dtype=dtype)
+        X_chunk -= mean
+        X_chunk /= std
+        y_chunk = (chunk.iloc[:, -1] == positiveLabel).to_numpy().astype(dtype)
+        yield X_chunk, y_chunk
+
+
+def fitChunkedCSV(model, filepath, numEpochs = 1, chunkSize = 10000, positiveLabel = None, numIters = None):
+    '''
+    Trains a model with partial_fit on a CSV too large to load at once (bounded memory two-pass pipeline)
+    Arguments:
+        model is a LogisticRegression or LogisticRegressionAdagrad object
+        filepath is the headerless CSV, features first and the label in the last column
+        numEpochs is the number of passes over the file after the statistics pass
+        chunkSize is the number of rows read into memory at a time
+        positiveLabel is the label mapped to 1, defaults to the label of the first row (as in test_dataanalysis)
+        numIters is passed to partial_fit for every chunk, defaults to 100 steps for LogisticRegression (its steps
+        use the averaged chunk gradient, a single step of the default alpha barely moves theta) and to one epoch
+        for LogisticRegressionAdagrad
+    Returns:
+        the trained model, with X_train_mean / X_train_std set to the statistics used for standardization
+        (with model.standardize the model standardizes the raw chunks itself and its theta scores raw features)
+    '''
+    mean, std, n, firstLabel = computeChunkedStats(filepath, chunkSize)
+    if positiveLabel is None:
+        positiveLabel = firstLabel
+    model.X_train_mean = mean
+    model.X_train_std = std
+    if model.standardize:   # partial_fit applies the statistics, the chunks are read unscaled
+        mean, std = np.zeros_like(mean), np.ones_like(std)
+    if numIters is None:
+        numIters = 1 if isinstance(model, LogisticRegressionAdagrad) else 100
+    for epoch in range(numEpochs):
+        for X_chunk, y_chunk in readStandardizedChunks(filepath, mean, std, positiveLabel, chunkSize, model.dtype):
+            model.partial_fit(X_chunk, y_chunk, numIters)
+    return model
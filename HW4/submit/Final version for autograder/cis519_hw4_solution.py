@@ -22,24 +22,202 @@ from sklearn import tree
 from sklearn.model_selection import train_test_split
 from sklearn.metrics import accuracy_score    # for comparing the labels and y_predict
 
+def binFeatures(X, maxBins=256):
+    '''
+    Quantizes every feature into at most maxBins bins, done once per fit for the histogram weak learner
+    A feature with at most maxBins distinct values gets one bin per value, otherwise the bin edges are
+    maxBins - 1 quantiles taken from the data values. Bin b of feature j holds edges[j][b-1] < x <= edges[j][b],
+    so the split "bin <= s" is the same as the threshold test "x <= edges[j][s]"
+    Arguments:
+        X is an n-by-d numpy array (compared in float32, as the sklearn trees do)
+    Returns:
+        the n-by-d uint8 array of bin indices, the list of the d edge arrays and the n-by-d array of the flat
+        (feature, bin) histogram index of every entry (bin + feature * bins, the bincount keys of HistogramTree)
+    '''
+    X_copy = np.asarray(X, dtype=np.float32)
+    n, d = X_copy.shape
+    X_binned = np.empty((n, d), dtype=np.uint8)
+    edges = []
+    for j in range(d):
+        values = np.unique(X_copy[:, j])
+        if len(values) <= maxBins:
+            curr_edges = values[:-1]    # one bin per value, the largest value needs no edge
+        else:   # the maxBins - 1 inner quantiles, an edge at the largest value would only add an empty bin
+            quantiles = np.unique(np.quantile(X_copy[:, j], np.linspace(0, 1, maxBins + 1)[1:-1], method='lower'))
+            curr_edges = quantiles[quantiles < values[-1]]
+        edges.append(curr_edges)
+        X_binned[:, j] = np.searchsorted(curr_edges, X_copy[:, j], side='left')
+    numBins = max(len(curr_edges) for curr_edges in edges) + 1
+    cells = X_binned.astype(np.intp) + np.arange(d) * numBins
+    return X_binned, edges, cells
+
+
+class HistogramTree:
+
+    def __init__(self, max_depth=3):
+        '''
+        Depth-limited decision tree grown from per-bin weighted class histograms (weak learner of BoostedDT
+        with weakLearner='hist'), on features already quantized by binFeatures
+        Every node takes the best Gini split among the bin boundaries from the d-by-bins-by-K histogram of the
+        weights of its rows, only the smaller child of a split is histogrammed (the larger one is the parent minus
+        the smaller one), so growing one level of the tree costs at most O(n*d/2) bincount work
+
+        Class Fields
+        feature, threshold, children_left, children_right, value : the node arrays, in the layout of sklearn's
+               tree_ (-1 children at the leaves, value is node-by-1-by-K), so BoostedDT.compile reads both kinds of trees
+        '''
+        self.max_depth = max_depth
+        self.classes_ = None
+
+    @property
+    def tree_(self):
+        return self     # the node arrays are stored on the tree itself
+
+    def fit(self, X_binned, cells, y, sample_weight, edges, classes):
+        '''
+        Grows the tree
+        Arguments:
+            X_binned is the n-by-d uint8 array, edges the bin edges and cells the histogram index from binFeatures
+            y is the flat array of class indices (into classes), sample_weight the flat n weights
+        Returns:
+            the class index predicted for every training row (read from the leaves, no second pass over X)
+        '''
+        n, d = X_binned.shape
+        K = len(classes)
+        self.classes_ = classes
+        numBins = max(len(curr_edges) for curr_edges in edges) + 1
+        feature, threshold, left, right, value = [], [], [], [], []
+        y_predict = np.empty(n, dtype=np.intp)
+
+        def histogram(rows):
+            hist = np.empty((K, d * numBins))
+            for k in range(K):  # one bincount per class
+                rows_k = rows[y[rows] == k]
+                hist[k] = np.bincount(cells[rows_k].ravel(), weights=np.repeat(sample_weight[rows_k], d), minlength=d * numBins)
+            return hist.reshape(K, d, numBins).transpose(1, 2, 0)
+
+        def grow(rows, depth, hist):
+            node = len(feature)
+            class_weight = np.bincount(y[rows], weights=sample_weight[rows], minlength=K)
+            feature.append(-2)
+            threshold.append(-2.0)
+            left.append(-1)
+            right.append(-1)
+            value.append(class_weight)
+            split = None
+            if depth < self.max_depth and np.count_nonzero(class_weight) > 1:
+                split = self.bestSplit(hist, class_weight)
+            if split is None:   # leaf
+                y_predict[rows] = np.argmax(class_weight)
+                return node
+            j, s = split
+            go_left = X_binned[rows, j] <= s
+            rows_left, rows_right = rows[go_left], rows[~go_left]
+            hist_left = hist_right = None
+            if depth + 1 < self.max_depth:  # the children split again, histogram the smaller one and subtract
+                if len(rows_left) <= len(rows_right):
+                    hist_left = histogram(rows_left)
+                    hist_right = np.maximum(hist - hist_left, 0)
+                else:
+                    hist_right = histogram(rows_right)
+                    hist_left = np.maximum(hist - hist_right, 0)
+            feature[node] = j
+            threshold[node] = float(edges[j][s])
+            left[node] = grow(rows_left, depth + 1, hist_left)
+            right[node] = grow(rows_right, depth + 1, hist_right)
+            return node
+
+        rows = np.arange(n)
+        grow(rows, 0, histogram(rows) if self.max_depth > 0 else None)
+        self.feature = np.array(feature, dtype=np.intp)
+        self.threshold = np.array(threshold, dtype=np.float64)
+        self.children_left = np.array(left, dtype=np.intp)
+        self.children_right = np.array(right, dtype=np.intp)
+        self.value = np.array(value)[:, None, :]
+        self.node_count = len(feature)
+        return y_predict
+
+    def bestSplit(self, hist, class_weight):
+        '''
+        Best Gini split of one node
+        Arguments:
+            hist is the d-by-bins-by-K array of the class weights of the node per feature and bin
+            class_weight is the K class weights of the node
+        Returns:
+            (feature, bin) of the best split "bin <= s goes left", None if no split lowers the impurity
+        '''
+        hist_left = np.cumsum(hist, axis=1)[:, :-1, :]    # class weights of bins <= s, for every feature and s
+        hist_right = class_weight - hist_left
+        weight_left = hist_left.sum(axis=2)
+        weight_right = hist_right.sum(axis=2)
+        tol = 1E-12 * class_weight.sum()    # a side holding only round-off of the histogram subtraction is empty
+        valid = (weight_left > tol) & (weight_right > tol)
+        # weighted Gini impurity is W - sum_k w_k^2 / W, so the best split maximizes the sum of sum_k w_k^2 / W over both sides
+        with np.errstate(divide='ignore', invalid='ignore'):
+            score = np.where(valid, np.square(hist_left).sum(axis=2) / weight_left
+                             + np.square(hist_right).sum(axis=2) / weight_right, -np.inf)
+        best = np.argmax(score)
+        if score.flat[best] <= np.square(class_weight).sum() / class_weight.sum() * (1 + 1E-12):
+            return None
+        return np.unravel_index(best, score.shape)
+
+    def get_depth(self):
+        '''
+        Depth of the tree (0 for a single leaf)
+        '''
+        depth = np.zeros(self.node_count, dtype=np.intp)
+        for node in range(self.node_count):     # children are always created after their parent
+            if self.children_left[node] != -1:
+                depth[self.children_left[node]] = depth[self.children_right[node]] = depth[node] + 1
+        return int(depth.max())
+
+    def predict(self, X):
+        '''
+        Predicts the class of every row of the n-by-d numpy array X (x <= threshold goes left)
+        '''
+        X_copy = np.asarray(X, dtype=np.float32)
+        node = np.zeros(len(X_copy), dtype=np.intp)
+        for level in range(self.get_depth()):
+            inner = self.children_left[node] != -1
+            go_left = X_copy[np.arange(len(X_copy)), np.maximum(self.feature[node], 0)] <= self.threshold[node]
+            node = np.where(inner, np.where(go_left, self.children_left[node], self.children_right[node]), node)
+        return self.classes_[np.argmax(self.value[node, 0, :], axis=1)]
+
+
 class BoostedDT:
 
-    def __init__(self, numBoostingIters=100, maxTreeDepth=3):
+    def __init__(self, numBoostingIters=100, maxTreeDepth=3, weakLearner='sklearn', maxBins=256):
         '''
         Constructor
+        weakLearner is 'sklearn' (tree.DecisionTreeClassifier) or 'hist' (HistogramTree on features quantized
+        once per fit into at most maxBins <= 256 bins)
 
         Class Fields 
         clfs : List object containing individual DecisionTree classifiers, in order of creation during boosting
                finally we will have T ht models after training
         betas : List of beta values, in order of creation during boosting
         '''
+        if weakLearner not in ('sklearn', 'hist'):
+            raise ValueError("weakLearner must be 'sklearn' or 'hist', got " + str(weakLearner))
+        if not 2 <= maxBins <= 256:
+            raise ValueError("maxBins must be between 2 and 256 (bins are stored as uint8), got " + str(maxBins))
 
         self.clfs = None  # keep the class fields, and be sure to keep them updated during boosting
         self.betas = None 
         self.numBoostingIters = numBoostingIters    # the number of iterations T
         self.maxTreeDepth = maxTreeDepth
+        self.weakLearner = weakLearner
+        self.maxBins = maxBins
         self.K = None       # labels include how many classes 
         self.classes = None
+        # flattened ensemble built by compile(), node arrays of all the trees concatenated
+        self.feature_ = None    # feature tested at every node (0 at the leaves)
+        self.threshold_ = None  # go right if x[feature] > threshold (+inf at the leaves, so they always go left)
+        self.children_ = None   # node-by-2 array of the left / right child (a leaf points to itself)
+        self.leafClass_ = None  # index in self.classes of the class predicted at the leaves
+        self.leafBeta_ = None   # beta of the tree of every node, the weight of the leaf's vote
+        self.roots_ = None      # index of the root of every tree
+        self.depth_ = None      # depth of the deepest tree
 
 
 
@@ -57,12 +235,10 @@ class BoostedDT:
         # get the class number K from the label y
         #
 
-        X = X.copy().to_numpy()
-        y = y.copy().to_numpy()
+        X = X.to_numpy()
+        y = np.asarray(y).ravel()   # flat n labels, any K classes (the trees are trained on them directly)
         n, d = X.shape  # use the whole data set for training   
-        y = y.reshape((n, 1))
-        y = np.where(y == 0, -1, y)
-        weights = np.ones((n, 1)) / n
+        weights = np.full(n, 1 / n)     # flat n weights, passed to the trees as they are
         num_iter = self.numBoostingIters  # get T 
         
         if self.clfs is None:   # initialize the clfs
@@ -71,33 +247,99 @@ class BoostedDT:
             self.betas = []
         self.classes = np.unique(y)        ######
         self.K = len(self.classes)     
+        if self.weakLearner == 'hist':  # quantize once, every round then only builds histograms
+            X_binned, edges, cells = binFeatures(X, self.maxBins)
+            y_codes = np.searchsorted(self.classes, y)
         
         for t in range(self.numBoostingIters):   
-            curr_clf = tree.DecisionTreeClassifier(max_depth=self.maxTreeDepth, random_state=random_state) # declare the tree
-            # print('&&&'+str(weights.shape))
-            weights_input = weights.reshape((n,))
-            curr_clf.fit(X, y, sample_weight = weights_input)    # train the model
-            error = 0
-            y_predict = curr_clf.predict(X).reshape((n, 1))
-            y_predict = np.where(y_predict == 0, -1, y_predict)
-            for i in range(n):
-                if y_predict[i] != y[i]:
-                    error += weights[i]
-            # error = np.sum(np.multiply(diff_y, weights))      # 多分类会出现负值
-            # print('error = '+str(error))
-            curr_beta = 1/2 * (np.log((1 - error)/error) + np.log(self.K - 1))   # more than one class
+            if self.weakLearner == 'hist':
+                curr_clf = HistogramTree(max_depth=self.maxTreeDepth)
+                miss = curr_clf.fit(X_binned, cells, y_codes, weights, edges, self.classes) != y_codes    # predictions read from the leaves
+            else:
+                curr_clf = tree.DecisionTreeClassifier(max_depth=self.maxTreeDepth, random_state=random_state) # declare the tree
+                curr_clf.fit(X, y, sample_weight = weights)    # train the model
+                miss = curr_clf.predict(X) != y     # boolean mask of the misclassified instances
+            error = np.dot(weights, miss)       # weighted error, sum of the weights of the mistakes
+            curr_beta = 1/2 * (np.log((1 - error)/error) + np.log(self.K - 1))   # SAMME, log(K-1) is 0 for two classes
 
             self.clfs.append(curr_clf)      # update the current tree into the list of clfs
             self.betas.append(curr_beta)    # update the beta list
-            # update the weights
+            # update the weights: w*exp(-beta) for the hits and w*exp(beta) for the mistakes,
+            # the common exp(-beta) factor cancels in the normalization so only the mistakes are scaled
+            weights[miss] *= np.exp(2 * curr_beta)
+            weights /= np.sum(weights)    # normalize the weights
+        self.compile()
 
-            # scalar = diff_y.copy()    #########
-            # scalar[scalar == 0] = -1
-            scalar = (y_predict == y).astype('int32').reshape((n, 1))
-            scalar = np.where(scalar == 0, -1, scalar)
-            weights = weights*np.exp( -curr_beta * scalar)
+    def compile(self):
+        '''
+        Flattens the fitted trees into contiguous numpy arrays (feature, threshold, children, leaf class, beta),
+        one entry per node of every tree, so predict can walk all the trees at once
+        A leaf is its own child with a +inf threshold, so every tree can be walked for exactly depth_ steps
+        '''
+        features, thresholds, children, classes, betas, roots = [], [], [], [], [], []
+        offset = 0
+        for curr_model, curr_beta in zip(self.clfs, self.betas):
+            curr_tree = curr_model.tree_
+            leaf = curr_tree.children_left == -1
+            nodes = np.arange(curr_tree.node_count)
+            features.append(np.where(leaf, 0, curr_tree.feature))
+            thresholds.append(np.where(leaf, np.inf, curr_tree.threshold))
+            children.append(np.c_[np.where(leaf, nodes, curr_tree.children_left),
+                                  np.where(leaf, nodes, curr_tree.children_right)] + offset)
+            leaf_label = curr_model.classes_[np.argmax(curr_tree.value[:, 0, :], axis=1)]   # same as the tree's predict
+            classes.append(np.searchsorted(self.classes, leaf_label))
+            betas.append(np.full(curr_tree.node_count, curr_beta, dtype=np.float64))
+            roots.append(offset)
+            offset += curr_tree.node_count
+        self.feature_ = np.concatenate(features).astype(np.intp)
+        self.threshold_ = np.concatenate(thresholds)
+        self.children_ = np.ascontiguousarray(np.concatenate(children), dtype=np.intp)
+        self.leafClass_ = np.concatenate(classes).astype(np.intp)
+        self.leafBeta_ = np.concatenate(betas)
+        self.roots_ = np.array(roots, dtype=np.intp)
+        self.depth_ = max(curr_model.get_depth() for curr_model in self.clfs)
+
+    def leafNodes(self, X, blockSize=512):
+        '''
+        Leaf reached by every instance in every tree, from the flattened ensemble
+        Rows are walked in blocks of blockSize: each step of the walk moves the (row, tree) node matrix
+        of the whole block one level down with a single gather / compare
+        Arguments:
+            X is an n-by-d Pandas Data Frame or numpy array
+        Yields:
+            (start, leaves) for every block, leaves is the block-by-T array of the leaves of rows start, start+1, ...
+        '''
+        if self.roots_ is None or len(self.roots_) != len(self.clfs):    # trees were added since the last compile
+            self.compile()
+        X_copy = np.asarray(X, dtype=np.float32)    # the trees compare float32 features, as sklearn does
+        n, d = X_copy.shape
+        children = self.children_.ravel()      # children of node i at 2*i (left) and 2*i+1 (right)
+        for start in range(0, n, blockSize):
+            X_block = np.ascontiguousarray(X_copy[start:start + blockSize]).ravel()    # flat, x[i, j] at i*d + j
+            row_offset = np.arange(min(blockSize, n - start))[:, None] * d
+            node = np.repeat(self.roots_[None, :], len(row_offset), axis=0)     # block-by-T current nodes
+            for level in range(self.depth_):
+                go_right = X_block[row_offset + self.feature_[node]] > self.threshold_[node]
+                node = children[2 * node + go_right]
+            yield start, node
 
-            weights = weights / np.sum(weights)    # normalize the weights
+    def classVotes(self, X, blockSize=512):
+        '''
+        SAMME vote matrix: entry (i, k) is the sum of the betas of the trees that predict self.classes[k] for instance i
+        Arguments:
+            X is an n-by-d Pandas Data Frame or numpy array
+        Returns:
+            an n-by-K numpy array
+        '''
+        n = X.shape[0]
+        votes = np.empty((n, self.K))
+        for start, leaves in self.leafNodes(X, blockSize):
+            b = len(leaves)
+            # add.at of beta into (row, class) for every (row, tree), done as one weighted bincount
+            cell = np.arange(b)[:, None] * self.K + self.leafClass_[leaves]
+            votes[start:start + b] = np.bincount(cell.ravel(), weights=self.leafBeta_[leaves].ravel(),
+                                                 minlength=b * self.K).reshape(b, self.K)
+        return votes
 
     
 
@@ -107,26 +349,42 @@ class BoostedDT:
         Arguments:
             X is an n-by-d Pandas Data Frame
         Returns:
-            an n-by-1 Pandas Data Frame of the predictions
+            an n-by-1 Pandas Data Frame of the predictions, the class with the largest weighted vote
         '''
-        #TODO
-        # print("Into prediction function!")
-        T = len(self.clfs)  
-        n, d = X.shape    # for n instances there should be n y-labels
-        X_copy = X.copy().to_numpy()
-        y_predict = np.zeros((n,1))
-        # y_class_pred = np.zeros((n, self.classNum))
-        for t in range(T):
-            curr_model = self.clfs[t] 
-            curr_beta = self.betas[t]
-            y_predict_t = curr_beta * curr_model.predict(X_copy).reshape((n, 1))      # get the current y preditc vector\
-            print('y_predict shape: '+str(y_predict_t.shape))
-            y_predict += y_predict_t
-        # print('**'+str(self.betas))
-        # print('**'+str(y_predict))
-        y_predict = pd.DataFrame(np.where(y_predict<=0, 0, 1))
-        # y_predict = np.where(y_predict == -1, 0, y_predict)
-        return y_predict
+        y_predict = self.classes[np.argmax(self.classVotes(X), axis=1)]     # ties go to the first class
+        return pd.DataFrame(y_predict)
+
+    def staged_predict(self, X):
+        '''
+        Predictions of the ensembles of the first t trees, for t = 1..T
+        The weighted votes are accumulated round by round, so the whole sequence costs a single pass over the trees
+        Arguments:
+            X is an n-by-d Pandas Data Frame
+        Yields:
+            an n-by-1 Pandas Data Frame of the predictions after every boosting round
+        '''
+        n = X.shape[0]
+        leaves = np.empty((n, len(self.clfs)), dtype=np.intp)
+        for start, block_leaves in self.leafNodes(X):
+            leaves[start:start + len(block_leaves)] = block_leaves
+        rows = np.arange(n)
+        votes = np.zeros((n, self.K))
+        for t in range(leaves.shape[1]):
+            votes[rows, self.leafClass_[leaves[:, t]]] += self.leafBeta_[leaves[:, t]]   # one vote per row, no repeated index
+            yield pd.DataFrame(self.classes[np.argmax(votes, axis=1)])
+
+    def staged_score(self, X, y):
+        '''
+        Accuracy of the ensembles of the first t trees on X, y, for t = 1..T (see staged_predict)
+        Arguments:
+            X is an n-by-d Pandas Data Frame
+            y is an n-by-1 Pandas Data Frame
+        Yields:
+            the accuracy after every boosting round
+        '''
+        y = np.asarray(y).ravel()
+        for y_predict in self.staged_predict(X):
+            yield accuracy_score(y, y_predict.to_numpy()[:, 0])
 
 """# Test BoostedDT"""
 
@@ -188,4 +446,27 @@ def test_boostedDT():
     print("exact same accuracy as Sklearn's boostedDT.  But, on repeated runs, they ")
     print("should be roughly equivalent and should usually exceed the standard DT.")
     # ================================================================================================
-# test_boostedDT()
\ No newline at end of file
+# test_boostedDT()
+
+"""# Tuning BoostedDT"""
+
+def tuneBoostedDT(X_train, y_train, X_test, y_test, iterValues, depthValues, random_state=None, weakLearner='sklearn'):
+    '''
+    Test accuracy of every (numBoostingIters, maxTreeDepth) pair with one fit per depth:
+    a T-round ensemble contains every shorter ensemble as a prefix of its clfs / betas,
+    so a single fit of max(iterValues) rounds is scored round by round with staged_score
+    weakLearner is passed to BoostedDT ('hist' makes long sweeps on large data affordable)
+    
+    Returns: a Pandas Data Frame of accuracies, one row per numBoostingIters and one column per depth
+    '''
+    accuracy = pd.DataFrame(index=sorted(iterValues), columns=depthValues, dtype=float)
+    for depth in depthValues:
+        modelBoostedDT = BoostedDT(numBoostingIters=max(iterValues), maxTreeDepth=depth, weakLearner=weakLearner)
+        modelBoostedDT.fit(X_train, y_train, random_state)
+        for t, curr_accuracy in enumerate(modelBoostedDT.staged_score(X_test, y_test), 1):
+            if t in accuracy.index:
+                accuracy.loc[t, depth] = curr_accuracy
+                print('====================')
+                print('boosting iter = ' + str(t) + '  tree depth = ' + str(depth))
+                print('My Boosted Decision Tree Accuracy = ' + str(curr_accuracy))
+    return accuracy